@@ -1,8 +1,24 @@
 import os
-from openpyxl import load_workbook
+import io
+import re
+import argparse
+from contextlib import redirect_stdout
+from collections import defaultdict
+from functools import partial
+import openpyxl
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.cell.read_only import EMPTY_CELL
+from openpyxl.styles.cell_style import StyleArray
 from openpyxl.utils import get_column_letter
-from copy import deepcopy
+from copy import copy
 from datetime import datetime
+from pipeline_timing import (add_arguments, configure_profiling, file_scope, init_worker,
+                             profiling_settings, span, take_spans, write_report)
+import rule_mapping
+from result_cache import add_cache_arguments, close_cache, code_version, open_cache
+from rule_mapping import extract_rule_code
+from worker_pool import run_in_pool
 
 # --- Конфигурация ---
 INPUT_DIR = 'INPUT'
@@ -22,6 +38,11 @@ COLUMN_ORDER = {
     "Последние 10 алер�": ["tenantID", "correlationRuleName", "id", "tenantName", "severity", "name", "status", "firstSeen", "userName", "priority"]
 }
 
+# Отбор строк листа "Распределение ал": регулярное выражение для столбца value
+# либо явный список кодов правил (например {"R001_01", "R071"}); список важнее выражения
+ALERT_RULE_PATTERN = r'R'
+ALERT_RULE_CODES = None
+
 MONTH_NAMES = {
     1: "января", 2: "февраля", 3: "марта", 4: "апреля",
     5: "мая", 6: "июня", 7: "июля", 8: "августа",
@@ -108,19 +129,72 @@ def set_column_widths(ws, order):
         col_letter = get_column_letter(col_idx)
         ws.column_dimensions[col_letter].width = calculate_column_width(ws, col_letter)
 
-def copy_first_row(source_ws, target_ws):
+def map_cell_style(cell, target_ws, style_cache, key=None):
+    """Возвращает индексы стиля для копии ячейки, переиспользуя общие объекты стилей книги;
+    key - ключ кэша (по умолчанию индексы стиля ячейки)"""
+    if key is None:
+        key = tuple(cell._style)
+    style = style_cache.get(key)
+    if style is None:
+        # Один раз на уникальный стиль повторяем прежнее присваивание пяти атрибутов
+        probe = Cell(target_ws)
+        probe.font = copy(cell.font)
+        probe.border = copy(cell.border)
+        probe.fill = copy(cell.fill)
+        probe.number_format = cell.number_format
+        probe.alignment = copy(cell.alignment)
+        style = style_cache[key] = probe._style
+    return style
+
+def copy_rows(source_ws, target_ws, style_cache, min_row=1, max_row=None):
+    """Переносит блок строк в лист той же книги без поячеечного копирования стилей"""
+    if max_row is None:
+        max_row = source_ws.max_row
+    max_col = source_ws.max_column
+    source_cells = source_ws._cells
+    target_cells = target_ws._cells
+
+    for row_idx in range(min_row, max_row + 1):
+        for col_idx in range(1, max_col + 1):
+            cell = source_cells.get((row_idx, col_idx))
+            if cell is None:
+                target_cells[(row_idx, col_idx)] = Cell(target_ws, row=row_idx, column=col_idx)
+                continue
+            new_cell = Cell(target_ws, row=row_idx, column=col_idx, value=cell.value)
+            if cell.has_style:
+                new_cell._style = StyleArray(map_cell_style(cell, target_ws, style_cache))
+            target_cells[(row_idx, col_idx)] = new_cell
+
+def copy_first_row(source_ws, target_ws, style_cache):
     """Копирует первую строку без изменений"""
-    for col_idx, cell in enumerate(source_ws[1], 1):
-        target_cell = target_ws.cell(row=1, column=col_idx, value=cell.value)
-        if cell.has_style:
-            target_cell.font = deepcopy(cell.font)
-            target_cell.border = deepcopy(cell.border)
-            target_cell.fill = deepcopy(cell.fill)
-            target_cell.number_format = cell.number_format
-            target_cell.alignment = deepcopy(cell.alignment)
-
-def filter_distribution_alerts(ws):
-    """Фильтрует строки в листе 'Распределение ал', оставляя только начинающиеся с R"""
+    copy_rows(source_ws, target_ws, style_cache, min_row=1, max_row=1)
+
+def alert_matches_codes(allowed, value):
+    return value is not None and extract_rule_code(value) in allowed
+
+def alert_matches_pattern(regex, value):
+    return value is not None and regex.match(str(value)) is not None
+
+def make_alert_filter(pattern=None, rule_codes=None):
+    """Возвращает предикат отбора строк по регулярному выражению или по списку кодов правил.
+
+    Без аргументов берутся ALERT_RULE_PATTERN и ALERT_RULE_CODES на момент вызова.
+    Предикат сериализуется pickle, поэтому его можно передавать в рабочие процессы.
+    """
+    if pattern is None and rule_codes is None:
+        pattern, rule_codes = ALERT_RULE_PATTERN, ALERT_RULE_CODES
+    if rule_codes is not None:
+        return partial(alert_matches_codes, frozenset(rule_codes))
+    return partial(alert_matches_pattern, re.compile(pattern))
+
+def parse_rule_codes(values):
+    """Разбирает коды правил из командной строки: через пробел и/или запятую"""
+    if values is None:
+        return None
+    return [code for value in values for code in re.split(r'[,\s]+', value) if code]
+
+def filter_distribution_alerts(ws, keep=None):
+    """Фильтрует строки в листе 'Распределение ал', оставляя только прошедшие отбор (по умолчанию начинающиеся с R)"""
     if ws.max_row <= 2:
         return
     
@@ -135,13 +209,32 @@ def filter_distribution_alerts(ws):
         print("Столбец 'value' не найден в листе 'Распределение ал'")
         return
 
-    # Удаляем строки, которые не начинаются с R (начиная с 3 строки)
-    row_idx = ws.max_row
-    while row_idx >= 3:
-        cell_value = ws.cell(row=row_idx, column=value_col_idx).value
-        if cell_value is None or not str(cell_value).startswith('R'):
-            ws.delete_rows(row_idx)
-        row_idx -= 1
+    if keep is None:
+        keep = make_alert_filter()
+
+    # Раскладываем ячейки по строкам за один проход
+    max_row = ws.max_row
+    rows = defaultdict(list)
+    for cell in ws._cells.values():
+        rows[cell.row].append(cell)
+
+    # Первые две строки остаются на месте, прошедшие отбор строки
+    # (начиная с 3) сдвигаются вверх без промежутков, лист переписывается один раз
+    new_cells = {}
+    next_row = 3
+    for row_idx in range(1, max_row + 1):
+        cells = rows.get(row_idx, [])
+        if row_idx >= 3:
+            value_cell = ws._cells.get((row_idx, value_col_idx))
+            if not keep(value_cell.value if value_cell is not None else None):
+                continue
+            for cell in cells:
+                cell.row = next_row
+            next_row += 1
+        for cell in cells:
+            new_cells[(cell.row, cell.column)] = cell
+
+    ws._cells = new_cells
 
 def reorder_columns(ws, order):
     """Изменяет порядок столбцов с сохранением первой строки"""
@@ -153,37 +246,35 @@ def reorder_columns(ws, order):
         print(f"Предупреждение: не все заголовки найдены в листе {ws.title}")
         return
 
-    data = {h: [] for h in headers}
-    styles = {h: [] for h in headers}
-    
-    for row in ws.iter_rows(min_row=3):
-        for idx, cell in enumerate(row):
-            if idx < len(headers):
-                data[headers[idx]].append(cell.value)
-                styles[headers[idx]].append({
-                    'font': deepcopy(cell.font) if cell.has_style else None,
-                    'border': deepcopy(cell.border) if cell.has_style else None,
-                    'fill': deepcopy(cell.fill) if cell.has_style else None,
-                    'number_format': cell.number_format,
-                    'alignment': deepcopy(cell.alignment) if cell.has_style else None
-                })
-
-    for col in range(ws.max_column, 1, -1):
-        ws.delete_cols(col)
-    
-    for col_idx, header in enumerate(order, 1):
-        if col_idx > 1:
-            ws.insert_cols(col_idx)
-        
-        ws.cell(row=2, column=col_idx, value=header)
-        
-        for row_idx, (value, style) in enumerate(zip(data[header], styles[header]), 3):
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-            if style['font']:
-                for attr, val in style.items():
-                    if val and hasattr(cell, attr):
-                        setattr(cell, attr, val)
+    # Перестановка: для каждого целевого столбца - номер исходного
+    permutation = [headers.index(h) + 1 for h in order]
+    max_row = ws.max_row
+    old_cells = ws._cells
+    new_cells = {}
+
+    # Первая строка, как и прежде, сохраняется только в столбце A
+    if (1, 1) in old_cells:
+        new_cells[(1, 1)] = old_cells[(1, 1)]
+
+    for col_idx, source_col in enumerate(permutation, 1):
+        header_cell = old_cells.get((2, 1)) if col_idx == 1 else None
+        if header_cell is None:
+            header_cell = Cell(ws, row=2, column=col_idx)
+        header_cell.value = order[col_idx - 1]
+        new_cells[(2, col_idx)] = header_cell
 
+        # Каждая ячейка данных переносится в итоговую позицию ровно один раз
+        for row_idx in range(3, max_row + 1):
+            cell = old_cells.get((row_idx, source_col))
+            if cell is None:
+                cell = Cell(ws, row=row_idx, column=col_idx)
+            elif col_idx == 1 and not cell.has_style and (row_idx, 1) in old_cells:
+                # Ячейка без стиля наследует оформление прежнего столбца A
+                cell._style = copy(old_cells[(row_idx, 1)]._style)
+            cell.column = col_idx
+            new_cells[(row_idx, col_idx)] = cell
+
+    ws._cells = new_cells
     set_column_widths(ws, order)
 
 def rename_sheets(wb):
@@ -197,130 +288,342 @@ def rename_sheets(wb):
         except Exception as e:
             print(f"Ошибка при переименовании листа '{original_name}': {str(e)}")
 
-def process_workbook(input_path, output_path):
-    """Обрабатывает один файл Excel"""
-    try:
-        wb_source = load_workbook(input_path)
+def sheet_summary(sheet_name, source_ws):
+    """Вычисляет итоги листа для первой строки результата:
+    список (номер столбца, значение, формат числа или None, сообщение)"""
+    summary = []
+    if sheet_name == "Общее число собы�":
+        date_value = source_ws['B1'].value
+        date_range = format_date_range(date_value) if date_value else None
+        total = sum_metric_column(source_ws, sheet_name)
+        if total is not None:
+            summary.append((7, total, '#,##0', f"Сумма столбца 'metric': {total:,.0f} (G1)"))
+        if date_range is not None:
+            summary.append((8, date_range, None, f"Форматированная дата: {date_range} (H1)"))
+    elif sheet_name == "Общее количество":
+        total = sum_metric_column(source_ws, sheet_name)
+        if total is not None:
+            summary.append((8, total, '#,##0', f"Сумма столбца 'metric': {total:,.0f} (H1)"))
+    elif sheet_name == "Затронутые актив":
+        count = count_data_rows(source_ws)
+        summary.append((8, count, None, f"Количество строк с данными: {count} (H1)"))
+    return summary
+
+def build_processed_workbook(input_path, keep=None):
+    """Строит обработанную книгу в памяти, не сохраняя ее; ошибки не перехватываются.
+
+    keep - предикат отбора строк листа "Распределение ал" (по умолчанию make_alert_filter())
+    """
+    # Книга загружается один раз: исходные листы отсоединяются от неё,
+    # а результат собирается в той же книге на общих таблицах стилей
+    with span("load"):
         wb_dest = load_workbook(input_path)
-        
-        while len(wb_dest.worksheets) > 0:
-            wb_dest.remove(wb_dest.worksheets[0])
-
-        results = {
-            "Общее количество": None,
-            "Общее число собы�": None,
-            "Затронутые актив": None,
-            "Дата событий": None
-        }
+    source_sheets = {ws.title: ws for ws in wb_dest.worksheets}
+    style_cache = {}
 
-        # Сначала обрабатываем все листы
-        for sheet_name in TARGET_ORDER:
-            if sheet_name in wb_source.sheetnames:
-                source_ws = wb_source[sheet_name]
-                dest_ws = wb_dest.create_sheet(sheet_name)
-                
-                copy_first_row(source_ws, dest_ws)
+    while len(wb_dest.worksheets) > 0:
+        wb_dest.remove(wb_dest.worksheets[0])
+
+    # Сначала обрабатываем все листы
+    for sheet_name in TARGET_ORDER:
+        if sheet_name in source_sheets:
+            source_ws = source_sheets[sheet_name]
+            dest_ws = wb_dest.create_sheet(sheet_name)
+            
+            copy_first_row(source_ws, dest_ws, style_cache)
+            summary = sheet_summary(sheet_name, source_ws)
+            
+            if not has_no_data(source_ws):
+                print(f"Обработка листа: {sheet_name}")
                 
-                if sheet_name == "Общее число собы�":
-                    date_cell = source_ws['B1']
-                    if date_cell.value:
-                        results["Дата событий"] = format_date_range(date_cell.value)
-                    results[sheet_name] = sum_metric_column(source_ws, sheet_name)
-                elif sheet_name == "Общее количество":
-                    results[sheet_name] = sum_metric_column(source_ws, sheet_name)
-                elif sheet_name == "Затронутые актив":
-                    results[sheet_name] = count_data_rows(source_ws)
+                with span("copy"):
+                    copy_rows(source_ws, dest_ws, style_cache, min_row=2)
                 
-                if not has_no_data(source_ws):
-                    print(f"Обработка листа: {sheet_name}")
-                    
-                    for row in source_ws.iter_rows(min_row=2):
-                        for cell in row:
-                            new_cell = dest_ws.cell(
-                                row=cell.row, 
-                                column=cell.column, 
-                                value=cell.value
-                            )
-                            if cell.has_style:
-                                new_cell.font = deepcopy(cell.font)
-                                new_cell.border = deepcopy(cell.border)
-                                new_cell.fill = deepcopy(cell.fill)
-                                new_cell.number_format = cell.number_format
-                                new_cell.alignment = deepcopy(cell.alignment)
-                    
-                    if sheet_name in COLUMN_ORDER:
+                if sheet_name in COLUMN_ORDER:
+                    with span("reorder"):
                         reorder_columns(dest_ws, COLUMN_ORDER[sheet_name])
-                    
-                    # Специальная обработка для листа "Распределение ал"
-                    if sheet_name == "Распределение ал":
-                        filter_distribution_alerts(dest_ws)
+                
+                # Специальная обработка для листа "Распределение ал"
+                if sheet_name == "Распределение ал":
+                    with span("filter"):
+                        filter_distribution_alerts(dest_ws, keep)
                         set_column_widths(dest_ws, COLUMN_ORDER[sheet_name])
-                    
-                    if sheet_name == "Общее количество" and results[sheet_name] is not None:
-                        dest_ws['H1'] = results[sheet_name]
-                        dest_ws['H1'].number_format = '#,##0'
-                        print(f"Сумма столбца 'metric': {results[sheet_name]:,.0f} (H1)")
-                    
-                    if sheet_name == "Общее число собы�":
-                        if results[sheet_name] is not None:
-                            dest_ws['G1'] = results[sheet_name]
-                            dest_ws['G1'].number_format = '#,##0'
-                            print(f"Сумма столбца 'metric': {results[sheet_name]:,.0f} (G1)")
-                        
-                        if results["Дата событий"] is not None:
-                            dest_ws['H1'] = results["Дата событий"]
-                            print(f"Форматированная дата: {results['Дата событий']} (H1)")
-                    
-                    if sheet_name == "Затронутые актив" and results[sheet_name] is not None:
-                        dest_ws['H1'] = results[sheet_name]
-                        print(f"Количество строк с данными: {results[sheet_name]} (H1)")
-                else:
-                    print(f"Пропуск преобразования листа '{sheet_name}' (содержит 'No Data')")
-                    for row in source_ws.iter_rows(min_row=2):
-                        for cell in row:
-                            new_cell = dest_ws.cell(
-                                row=cell.row, 
-                                column=cell.column, 
-                                value=cell.value
-                            )
-                            if cell.has_style:
-                                new_cell.font = deepcopy(cell.font)
-                                new_cell.border = deepcopy(cell.border)
-                                new_cell.fill = deepcopy(cell.fill)
-                                new_cell.number_format = cell.number_format
-                                new_cell.alignment = deepcopy(cell.alignment)
-
-        # Переименовываем листы после обработки
-        rename_sheets(wb_dest)
+                
+                for column, value, number_format, message in summary:
+                    dest_ws.cell(1, column, value)
+                    if number_format:
+                        dest_ws.cell(1, column).number_format = number_format
+                    print(message)
+            else:
+                print(f"Пропуск преобразования листа '{sheet_name}' (содержит 'No Data')")
+                with span("copy"):
+                    copy_rows(source_ws, dest_ws, style_cache, min_row=2)
+
+    # Переименовываем листы после обработки
+    rename_sheets(wb_dest)
+    return wb_dest
+
+def styled_cell(cell):
+    """Возвращает ячейку книги только для чтения, если у нее есть стиль, иначе None"""
+    return cell if getattr(cell, "has_style", False) else None
+
+def stream_permutation(source_ws, order):
+    """Возвращает номера исходных столбцов (с 0) для столбцов order
+    или None, если лист пересортировать нельзя"""
+    for headers in source_ws.iter_rows(min_row=2, max_row=2, values_only=True):
+        if all(h in headers for h in order):
+            return [headers.index(h) for h in order]
+        print(f"Предупреждение: не все заголовки найдены в листе {source_ws.title}")
+    return None
+
+def stream_rows(source_ws, permutation=None, order=None, keep=None, verbose=True):
+    """Потоково пересортировывает и отбирает строки листа книги, открытой только для чтения.
+
+    Выдает строки результата - списки пар (значение, ячейка-источник стиля или None) -
+    такими же, какими их оставляют reorder_columns и filter_distribution_alerts.
+    permutation - результат stream_permutation для order, keep - предикат отбора
+    по столбцу value, verbose - выводить ли предупреждения (при повторном проходе не нужно).
+    """
+    rows = source_ws.iter_rows()
+    first_row = next(rows, None)
+    if first_row is None:
+        return
+    header_row = next(rows, None)
+
+    if permutation is None:
+        yield [(cell.value, styled_cell(cell)) for cell in first_row]
+        if header_row is None:
+            return
+        yield [(cell.value, styled_cell(cell)) for cell in header_row]
+        headers = [cell.value for cell in header_row]
+    else:
+        # Первая строка сохраняется только в столбце A, заголовок A сохраняет оформление
+        yield [(first_row[0].value, styled_cell(first_row[0]))] if first_row else []
+        yield [(order[0], styled_cell(header_row[0]) if header_row else None)] + [(h, None) for h in order[1:]]
+        headers = order
+
+    value_idx = None
+    warn = False
+    if keep is not None:
+        if "value" in headers:
+            value_idx = headers.index("value")
+        else:
+            keep = None
+            # Как и filter_distribution_alerts, предупреждаем только при наличии строк данных
+            warn = verbose
+
+    for row in rows:
+        if permutation is None:
+            cells = [(cell.value, styled_cell(cell)) for cell in row]
+        else:
+            first_style = styled_cell(row[0]) if row else None
+            cells = []
+            for source_idx in permutation:
+                cell = row[source_idx] if source_idx < len(row) else EMPTY_CELL
+                # Ячейка без стиля в столбце A наследует оформление прежнего столбца A
+                cells.append((cell.value, styled_cell(cell) or (first_style if not cells else None)))
+        if keep is not None:
+            if not keep(cells[value_idx][0] if value_idx < len(cells) else None):
+                continue
+        elif warn:
+            print(f"Столбец 'value' не найден в листе '{source_ws.title}'")
+            warn = False
+        yield cells
+
+def stream_column_widths(rows, column_count):
+    """Вычисляет ширину первых column_count столбцов по текущим максимумам длины значений
+    (как calculate_column_width, но без хранения строк)"""
+    max_lengths = [0] * column_count
+    for cells in rows:
+        for col_idx in range(column_count):
+            value = cells[col_idx][0] if col_idx < len(cells) else None
+            length = len(str(value) if value else "") * 1.1 + 2
+            if length > max_lengths[col_idx]:
+                max_lengths[col_idx] = length
+    return [min(length, 50) for length in max_lengths]
+
+def append_stream_row(target_ws, cells, style_cache, summary=()):
+    """Дописывает строку в лист книги write_only; summary - итоги первой строки (см. sheet_summary)"""
+    values = []
+    for value, source in cells:
+        if source is not None:
+            value = WriteOnlyCell(target_ws, value=value)
+            value._style = StyleArray(map_cell_style(source, target_ws, style_cache, source._style_id))
+        values.append(value)
+    for column, value, number_format, _ in summary:
+        values.extend([None] * (column - len(values)))
+        cell = values[column - 1]
+        if not isinstance(cell, Cell):
+            cell = values[column - 1] = WriteOnlyCell(target_ws)
+        cell.value = value
+        if number_format:
+            cell.number_format = number_format
+    target_ws.append(values)
+
+def stream_processed_workbook(input_path, output_path, keep=None):
+    """Строит и сохраняет обработанную книгу потоково: исходная книга читается
+    в режиме read_only, результат пишется в режиме write_only по одной строке,
+    поэтому память не растет с числом строк. Ширина столбцов вычисляется
+    отдельным проходом по листу до записи. Ошибки не перехватываются.
+    keep - как в build_processed_workbook."""
+    alert_filter = keep if keep is not None else make_alert_filter()
+    with span("load"):
+        wb_source = load_workbook(input_path, read_only=True)
+    try:
+        wb_dest = Workbook(write_only=True)
+        style_cache = {}
+
+        for sheet_name in TARGET_ORDER:
+            if sheet_name not in wb_source.sheetnames:
+                continue
+            source_ws = wb_source[sheet_name]
+            dest_ws = wb_dest.create_sheet(sheet_name)
+            summary = sheet_summary(sheet_name, source_ws)
+
+            order = COLUMN_ORDER.get(sheet_name)
+            permutation = keep = None
+            width_count = 0
+            if not has_no_data(source_ws):
+                print(f"Обработка листа: {sheet_name}")
+                if order is not None:
+                    permutation = stream_permutation(source_ws, order)
+                    if permutation is not None:
+                        width_count = len(order)
+                # Специальная обработка для листа "Распределение ал"
+                if sheet_name == "Распределение ал":
+                    keep = alert_filter
+                    width_count = len(order)
+            else:
+                print(f"Пропуск преобразования листа '{sheet_name}' (содержит 'No Data')")
+                summary = []
+
+            # Ширина столбцов записывается в начало листа, поэтому считается заранее
+            if width_count:
+                with span("widths"):
+                    widths = stream_column_widths(stream_rows(source_ws, permutation, order, keep), width_count)
+                for col_idx, width in enumerate(widths, 1):
+                    dest_ws.column_dimensions[get_column_letter(col_idx)].width = width
+
+            with span("copy"):
+                rows = stream_rows(source_ws, permutation, order, keep, verbose=not width_count)
+                first_cells = next(rows, [])
+                append_stream_row(dest_ws, first_cells, style_cache, summary)
+                for cells in rows:
+                    append_stream_row(dest_ws, cells, style_cache)
 
-        wb_dest.save(output_path)
+            for _, _, _, message in summary:
+                print(message)
+
+        rename_sheets(wb_dest)
+        with span("save"):
+            wb_dest.save(output_path)
+    finally:
         wb_source.close()
-        wb_dest.close()
+
+def process_workbook(input_path, output_path, cache=None, streaming=False, keep=None):
+    """Обрабатывает один файл Excel; при наличии кэша (ResultCache) неизмененный
+    файл не обрабатывается повторно, streaming - потоковая обработка больших книг,
+    keep - предикат отбора строк листа "Распределение ал" (его нужно учесть в ключе кэша)"""
+    try:
+        if cache is not None:
+            with span("cache"):
+                key = cache.key(input_path)
+                if cache.fetch(key, output_path):
+                    print(f"Файл не изменился, результат взят из кэша: {os.path.basename(output_path)}")
+                    return True
+
+        if streaming:
+            stream_processed_workbook(input_path, output_path, keep)
+        else:
+            wb_dest = build_processed_workbook(input_path, keep)
+
+            with span("save"):
+                wb_dest.save(output_path)
+            wb_dest.close()
+        if cache is not None:
+            cache.store(key, output_path)
         print(f"Файл успешно обработан: {os.path.basename(output_path)}")
         return True
     except Exception as e:
         print(f"Ошибка при обработке файла {input_path}: {str(e)}")
         return False
 
-def process_all_reports():
+def process_workbook_isolated(input_path, output_path, cache=None, streaming=False, keep=None):
+    """Обрабатывает файл в рабочем процессе, собирая весь его вывод в одну строку;
+    возвращает результат, время (не выводится в журнал пересортировки, поэтому None),
+    вывод и замеры времени этапов"""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer), file_scope(input_path):
+        success = process_workbook(input_path, output_path, cache, streaming, keep)
+    return success, None, buffer.getvalue(), take_spans()
+
+def process_all_reports(jobs=1, cache=None, streaming=False, keep=None):
     """Обрабатывает все файлы в каталоге reports"""
     ensure_directories_exist()
     
     processed_count = 0
     error_count = 0
     
+    tasks = []
     for filename in os.listdir(INPUT_DIR):
         if filename.endswith('.xlsx'):
             input_path = os.path.join(INPUT_DIR, filename)
             output_path = os.path.join(OUTPUT_DIR, "processed_" + filename)
-            
+            tasks.append((filename, input_path, output_path))
+
+    if jobs > 1 and len(tasks) > 1:
+        # Каждый файл обрабатывается в пуле процессов
+        pool_tasks = {
+            filename: (input_path, output_path, cache, streaming, keep)
+            for filename, input_path, output_path in tasks
+        }
+        processed_count = run_in_pool(process_workbook_isolated, pool_tasks, jobs, init_worker,
+                                      profiling_settings(), header="\nНачата обработка файла: {}")
+        error_count = len(tasks) - processed_count
+    else:
+        for filename, input_path, output_path in tasks:
             print(f"\nНачата обработка файла: {filename}")
-            if process_workbook(input_path, output_path):
+            with file_scope(input_path):
+                success = process_workbook(input_path, output_path, cache, streaming, keep)
+            if success:
                 processed_count += 1
             else:
                 error_count += 1
     
     print(f"\nОбработка завершена. Успешно: {processed_count}, с ошибками: {error_count}")
 
-# Запуск обработки всех файлов
-process_all_reports()
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description="Пересортировка выгрузок KUMA из каталога INPUT")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="число параллельных процессов (0 - по числу ядер)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="потоковая обработка: память не растет с числом строк (для больших выгрузок)")
+    parser.add_argument("--alert-pattern", metavar="REGEX",
+                        help=f"отбор строк листа 'Распределение ал' по регулярному выражению "
+                             f"(по умолчанию {ALERT_RULE_PATTERN})")
+    parser.add_argument("--alert-codes", nargs="+", metavar="КОД",
+                        help="отбор строк листа 'Распределение ал' по кодам правил (через пробел или запятую); "
+                             "важнее --alert-pattern")
+    add_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+
+    configure_profiling(args.profile, args.profile_dir)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    alert_codes = parse_rule_codes(args.alert_codes)
+    try:
+        keep = make_alert_filter(args.alert_pattern, alert_codes)
+    except re.error as e:
+        parser.error(f"некорректное регулярное выражение --alert-pattern: {e}")
+    # Результат зависит только от выгрузки, кода скрипта (и разбора кодов правил), версии openpyxl,
+    # режима обработки и отбора строк "Распределение ал"
+    cache = open_cache(args, "reordering", code_version(__file__, rule_mapping.__file__),
+                       openpyxl.__version__, args.streaming,
+                       args.alert_pattern, sorted(set(alert_codes)) if alert_codes is not None else None)
+    process_all_reports(jobs, cache, args.streaming, keep)
+    close_cache(args)
+    if args.timings:
+        write_report(args.timings, "reordering")
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,183 @@
 import os
-import re
+import json
 import pandas as pd
 from openpyxl import load_workbook
 import tempfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+from rule_mapping import extract_rule_code, load_rule_mapping
+from result_cache import file_digest
+from pipeline_timing import (add_arguments, add_spans, configure_profiling, file_scope, init_worker,
+                             profiling_settings, span, take_spans, write_report)
 
-# Функция для извлечения кодов правил из названий
-def extract_rule_code(rule_name):
-    match = re.search(r'R\d+(_\d+)*', rule_name)
-    return match.group(0) if match else None
+# Файл привязок правил к тактикам MITRE
+MITRE_FILE = 'MITRE.xlsx'
 
-# Функция для поиска тактики MITRE по коду правила
-def find_mitre_tactic(rule_code, mitre_data):
+# Манифест инкрементальной сборки: отпечатки processed-файлов и найденные в них правила
+MANIFEST_FILE = 'rules_manifest.json'
+
+# Функция для построения индекса: код правила без 'R' -> тактики MITRE
+# (в порядке столбцов MITRE.xlsx, правило может относиться к нескольким тактикам)
+def build_mitre_index(mitre_data):
+    index = defaultdict(list)
+    for col in mitre_data.columns[1:]:  # Пропускаем первый столбец
+        for value in mitre_data[col].dropna():
+            # Коды, сохраненные в Excel числами (207), приводим к строке
+            code = str(int(value)) if isinstance(value, (int, float)) else str(value).strip()
+            if col not in index[code]:
+                index[code].append(col)
+    return dict(index)
+
+# Функция для поиска всех тактик MITRE по коду правила
+def find_mitre_tactics(rule_code, mitre_index):
     if not rule_code:
-        return None
-        
+        return []
+
     code_only = rule_code[1:] if rule_code.startswith('R') else rule_code
-    
-    for col in mitre_data.columns[1:]:  # Пропускаем первый столбец
-        if code_only in mitre_data[col].values:
-            return mitre_data.columns[mitre_data.columns.get_loc(col)]
-    return None
+    return mitre_index.get(code_only, [])
+
+# Функция для поиска тактики MITRE по коду правила (первая по порядку столбцов)
+def find_mitre_tactic(rule_code, mitre_index):
+    tactics = find_mitre_tactics(rule_code, mitre_index)
+    return tactics[0] if tactics else None
+
+# Функция для чтения правил из столбца A листа 1-6 (начиная с 3 строки);
+# лист может быть открыт с диска или построен в памяти
+def worksheet_rules(ws):
+    rules = set()
+    for (value,) in ws.iter_rows(min_row=3, min_col=1, max_col=1, values_only=True):
+        if value is None or value == "":
+            continue
+        # Целые числа, сохраненные как float, приводим к int (как это делал pandas)
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        rules.add(value)
+    return rules
+
+# Функция для потокового чтения правил из файла:
+# в памяти держится только текущая строка и множество найденных правил
+def extract_sheet_rules(file_path):
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        return worksheet_rules(wb['1-6'])
+    finally:
+        wb.close()
+
+# Функция для чтения правил файла в рабочем процессе: возвращает и замеры времени
+def extract_sheet_rules_timed(file_path):
+    with file_scope(file_path), span("extract"):
+        rules = extract_sheet_rules(file_path)
+    return rules, take_spans()
+
+# Функция для чтения правил из набора файлов (в пуле процессов при jobs > 1);
+# возвращает словарь файл -> множество правил, файлы с ошибками пропускаются
+def extract_rules_from_files(output_dir, files, jobs=1):
+    file_paths = [os.path.join(output_dir, file) for file in files]
+    rules_by_file = {}
+    if jobs > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(file_paths)), initializer=init_worker,
+                                 initargs=profiling_settings()) as executor:
+            futures = [executor.submit(extract_sheet_rules_timed, path) for path in file_paths]
+            for file, future in zip(files, futures):
+                try:
+                    rules_by_file[file], spans = future.result()
+                    add_spans(spans)
+                except Exception as e:
+                    print(f"Ошибка при обработке файла {file}: {e}")
+    else:
+        for file, file_path in zip(files, file_paths):
+            try:
+                with file_scope(file_path), span("extract"):
+                    rules_by_file[file] = extract_sheet_rules(file_path)
+            except Exception as e:
+                print(f"Ошибка при обработке файла {file}: {e}")
+    return rules_by_file
 
-# Основной код
-def main():
+# Функция для чтения манифеста инкрементальной сборки
+def load_manifest(path=MANIFEST_FILE):
     try:
-        # Загрузка данных MITRE
-        mitre_file = 'MITRE.xlsx'
-        mitre_data = pd.read_excel(mitre_file, sheet_name='Лист1', header=0)
+        with open(path, encoding='utf-8') as f:
+            return json.load(f).get('files', {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Не удалось прочитать манифест {path}, файлы будут прочитаны заново: {e}")
+        return {}
+
+# Функция для атомарной записи манифеста
+def save_manifest(entries, path=MANIFEST_FILE):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'files': entries}, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, path)
+
+# Функция для инкрементального сбора правил: заново читаются только новые
+# и измененные файлы, для остальных правила берутся из манифеста
+def collect_rules_incremental(output_dir, processed_files, jobs=1):
+    manifest = load_manifest()
+    entries = {}
+    changed = {}
+
+    for file in processed_files:
+        stat = os.stat(os.path.join(output_dir, file))
+        entry = manifest.get(file)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            entries[file] = entry
+            continue
+        # Размер или время изменения отличаются - сверяем содержимое
+        digest = file_digest(os.path.join(output_dir, file))
+        if entry and entry['sha256'] == digest:
+            entries[file] = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            continue
+        changed[file] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+
+    for file, rules in extract_rules_from_files(output_dir, list(changed), jobs).items():
+        entries[file] = dict(changed[file], rules=sorted(rules, key=str))
+
+    # Удаленные из каталога файлы в манифест не попадают
+    save_manifest(entries)
+    print(f"Прочитано файлов: {len(changed)}, взято из манифеста: {len(processed_files) - len(changed)}")
+
+    unique_rules = set()
+    for entry in entries.values():
+        unique_rules.update(entry['rules'])
+    return unique_rules
+
+# Функция для загрузки источника привязок: возвращает пару (сопоставление из CSV, индекс MITRE.xlsx),
+# заполнен один из элементов в зависимости от source
+def load_rules_source(source='xlsx'):
+    if source == 'csv':
+        # Привязки к тактикам и техникам из CSV-файлов D001/D002
+        return load_rule_mapping(), None
+    # Загрузка данных MITRE
+    mitre_data = pd.read_excel(MITRE_FILE, sheet_name='Лист1', header=0)
+    return None, build_mitre_index(mitre_data)
+
+# Функция для построения строк rules.xlsx по набору правил
+def build_rule_rows(unique_rules, rule_mapping=None, mitre_index=None):
+    results = []
+    for rule in unique_rules:
+        rule_code = extract_rule_code(str(rule))  # Преобразуем в строку на всякий случай
+        if rule_code:
+            code_only = rule_code[1:]  # Убираем 'R'
+            if rule_mapping is not None:
+                tactics = rule_mapping.tactic_names(rule_code)
+                techniques = rule_mapping.rule_techniques(rule_code)
+            else:
+                tactics = find_mitre_tactics(rule_code, mitre_index)
+                techniques = ()
+            tactic = tactics[0] if tactics else None
+            results.append([rule, rule_code, code_only, tactic,
+                            ', '.join(tactics) or None, ', '.join(techniques) or None])
+    return results
+
+# Основной код; source - источник привязок: 'xlsx' (MITRE.xlsx) или 'csv' (D001/D002),
+# jobs - число процессов для чтения processed-файлов, incremental - сборка по манифесту
+def main(source='xlsx', jobs=1, incremental=False):
+    try:
+        with span("mapping"):
+            rule_mapping, mitre_index = load_rules_source(source)
         
         # Поиск processed-файлов в каталоге output
         output_dir = 'output'
@@ -34,36 +185,26 @@ def main():
                           if f.startswith('processed') and f.endswith('.xlsx')]
         
         # Сбор уникальных значений из столбца A листа 1-6
-        unique_rules = set()
-        
-        for file in processed_files:
-            file_path = os.path.join(output_dir, file)
-            try:
-                df = pd.read_excel(file_path, sheet_name='1-6', header=None)
-                # Пропускаем первые две строки и берем данные из столбца A
-                rules = df.iloc[2:, 0].dropna().unique()
+        if incremental:
+            unique_rules = collect_rules_incremental(output_dir, processed_files, jobs)
+        else:
+            unique_rules = set()
+            for rules in extract_rules_from_files(output_dir, processed_files, jobs).values():
                 unique_rules.update(rules)
-            except Exception as e:
-                print(f"Ошибка при обработке файла {file}: {e}")
         
         # Создание DataFrame для результатов
-        results = []
-        
-        for rule in unique_rules:
-            rule_code = extract_rule_code(str(rule))  # Преобразуем в строку на всякий случай
-            if rule_code:
-                code_only = rule_code[1:]  # Убираем 'R'
-                tactic = find_mitre_tactic(rule_code, mitre_data)
-                results.append([rule, rule_code, code_only, tactic])
+        with span("resolve"):
+            results = build_rule_rows(unique_rules, rule_mapping, mitre_index)
         
         # Создание итогового DataFrame
         result_df = pd.DataFrame(results, columns=[
-            'Original_Rule', 'Rule_Code', 'Code_Only', 'MITRE_Tactic'
+            'Original_Rule', 'Rule_Code', 'Code_Only', 'MITRE_Tactic', 'MITRE_Tactics', 'MITRE_Techniques'
         ])
         
         # Попытка сохранения в текущую директорию
         try:
-            result_df.to_excel('rules.xlsx', index=False)
+            with span("write"):
+                result_df.to_excel('rules.xlsx', index=False)
             print("Файл rules.xlsx успешно создан в текущей директории")
         except Exception as e:
             print(f"Не удалось сохранить в текущую директорию: {e}")
@@ -93,4 +234,16 @@ def main():
         print(f"Общая ошибка выполнения: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Сбор сработавших правил и привязка их к тактикам MITRE")
+    parser.add_argument("--source", choices=["xlsx", "csv"], default="xlsx",
+                        help="источник привязок: MITRE.xlsx или CSV-файлы D001/D002")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="число параллельных процессов (0 - по числу ядер)")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"читать только новые и измененные файлы, используя манифест {MANIFEST_FILE}")
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_profiling(args.profile, args.profile_dir)
+    main(args.source, args.jobs if args.jobs > 0 else (os.cpu_count() or 1), args.incremental)
+    if args.timings:
+        write_report(args.timings, "take_rules")
\ No newline at end of file
@@ -1,39 +1,80 @@
 import pandas as pd
+import io
+import time
+import argparse
+from contextlib import redirect_stdout
+from typing import NamedTuple
+from openpyxl import load_workbook
+import rule_mapping
+from rule_mapping import TACTICS_CSV, TECHNIQUES_CSV, extract_rule_code, load_rule_mapping
+import docx
 from docx import Document
 from docx.shared import Pt
 from datetime import datetime, timedelta
 import os
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+from docx.table import Table
+from docx.opc.part import XmlPart
+from docx.opc.parts.coreprops import CorePropertiesPart
+from docx.parts.numbering import NumberingPart
+from docx.parts.settings import SettingsPart
+from docx.parts.styles import StylesPart
+from docx.shared import lazyproperty
+import copy
+from lxml import etree
 import re
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
 from docx.shared import Inches
-from collections import defaultdict
-import matplotlib.font_manager as fm
+from functools import lru_cache
+from bisect import bisect_right
+from itertools import accumulate
+import font_registry
+from font_registry import FONT_DIR, font_properties, load_font_registry
+from pipeline_timing import (add_arguments, configure_profiling, file_scope, init_worker,
+                             profiling_settings, span, take_spans, write_report)
+from result_cache import (add_cache_arguments, close_cache, code_version, file_digest, open_cache,
+                          optional_digest)
+from worker_pool import run_in_pool
 
-# Установка шрифта для matplotlib
-def setup_matplotlib_font():
+# Начертания, уже настроенные в текущем процессе: начертание -> FontProperties или None
+_chart_fonts = {}
+
+# Установка шрифта для matplotlib (один раз на процесс для каждого начертания).
+# Все начертания PF Centro называются одинаково, поэтому font.family задает только
+# семейство, а само начертание (по имени из реестра шрифтов каталога PFCentroSansPro)
+# передается в вызовы текста через возвращаемый FontProperties
+def setup_matplotlib_font(style="Regular"):
+    if style in _chart_fonts:
+        return _chart_fonts[style]
+    prop = None
     try:
-        # Ищем файл шрифта в каталоге PFCentroSansPro
-        font_dir = "PFCentroSansPro"
-        if os.path.exists(font_dir):
-            # Ищем файлы шрифтов в каталоге
-            font_files = []
-            for file in os.listdir(font_dir):
-                if file.lower().endswith(('.ttf', '.otf')):
-                    font_files.append(os.path.join(font_dir, file))
-            
-            if font_files:
-                # Используем первый найденный файл шрифта
-                prop = fm.FontProperties(fname=font_files[0])
-                plt.rcParams['font.family'] = prop.get_name()
-                print(f"Установлен шрифт: {prop.get_name()}")
-            else:
-                print("В каталоге PFCentroSansPro не найдено файлов шрифтов. Используется стандартный шрифт.")
+        prop = font_properties(style)
+        if prop is not None:
+            matplotlib.rcParams['font.family'] = prop.get_name()
+            print(f"Установлен шрифт: {prop.get_name()} ({style})")
+        elif os.path.exists(FONT_DIR):
+            print("В каталоге PFCentroSansPro не найдено файлов шрифтов. Используется стандартный шрифт.")
         else:
             print("Каталог PFCentroSansPro не найден. Используется стандартный шрифт.")
     except Exception as e:
         print(f"Ошибка при настройке шрифта: {e}")
+    _chart_fonts[style] = prop
+    return prop
+
+def chart_text_font(font, size=None):
+    """Параметры текста диаграммы: начертание font (FontProperties или None) и размер size"""
+    if font is None:
+        return {} if size is None else {"fontsize": size}
+    # Размер задается в копии начертания: set_title не дает fontsize переопределить fontproperties
+    font = font.copy()
+    if size is not None:
+        font.set_size(size)
+    return {"fontproperties": font}
 
 def set_cell_text(cell, text, font_name='PF Centro Sans Pro', font_size=Pt(14)):
     """Устанавливает текст в ячейке с указанным шрифтом и размером"""
@@ -44,6 +85,44 @@ def set_cell_text(cell, text, font_name='PF Centro Sans Pro', font_size=Pt(14)):
     run.font.size = font_size
     paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
 
+def set_run_text(r, text):
+    """Записывает текст в пустой фрагмент (w:r) так же, как python-docx"""
+    if '\t' in text or '\n' in text or '\r' in text:
+        # Табуляции и переводы строк python-docx превращает в отдельные элементы
+        r.text = text
+        return
+    t = etree.SubElement(r, qn('w:t'))
+    t.text = text
+    if text != text.strip():
+        t.set(qn('xml:space'), 'preserve')
+
+def append_table_rows(table, rows, min_cells=0, font_name='PF Centro Sans Pro', font_size=Pt(14)):
+    """Добавляет в таблицу строки с текстом ячеек, оформленные как в set_cell_text.
+
+    Строка-прототип строится один раз средствами python-docx, остальные строки
+    получаются ее копированием с записью текста прямо в XML.
+    """
+    prototype = table.add_row()
+    while len(prototype.cells) < min_cells:
+        prototype.add_cell()
+    for cell in prototype.cells:
+        set_cell_text(cell, '', font_name, font_size)
+    tr = prototype._tr
+    tbl = tr.getparent()
+    tbl.remove(tr)
+
+    # Пустой фрагмент текста в первом параграфе каждой ячейки
+    run_paths = [element_path(tr, tc.p_lst[0].r_lst[-1]) for tc in tr.tc_lst]
+    new_rows = []
+    for values in rows:
+        row = copy.deepcopy(tr)
+        for path, value in zip(run_paths, values):
+            text = str(value) if value is not None else ''
+            if text:
+                set_run_text(resolve_path(row, path), text)
+        new_rows.append(row)
+    tbl.extend(new_rows)
+
 def get_russian_month():
     """Возвращает предыдущий месяц на русском с заглавной буквы"""
     months = {
@@ -66,41 +145,179 @@ def get_russian_month():
     
     return months.get(previous_month, "")
 
+# Плейсхолдер вида {ключ}; в шаблоне он обычно разбит Word на несколько фрагментов
+PLACEHOLDER_PATTERN = re.compile(r'\{[^{}]+\}')
+
+def iter_story_roots(doc):
+    """Возвращает пары (корневой элемент, владелец) для тела документа и всех колонтитулов"""
+    roots = [(doc.element.body, doc._body)]
+    seen = set()
+    for section in doc.sections:
+        for header_footer in (section.header, section.first_page_header, section.even_page_header,
+                              section.footer, section.first_page_footer, section.even_page_footer):
+            # У связанного с предыдущим разделом колонтитула нет собственной части
+            if header_footer.is_linked_to_previous:
+                continue
+            element = header_footer._element
+            if id(element) not in seen:
+                seen.add(id(element))
+                roots.append((element, header_footer))
+    return roots
+
+def paragraph_text_nodes(p):
+    """Возвращает элементы w:t параграфа, не заходя во вложенные параграфы (надписи)"""
+    nodes = []
+
+    def walk(element):
+        for child in element:
+            if child.tag == qn('w:t'):
+                nodes.append(child)
+            elif child.tag not in (qn('w:p'), qn('w:txbxContent')):
+                walk(child)
+
+    walk(p)
+    return nodes
+
+def substitute_paragraph(p, replacements, unresolved, owner):
+    """Заменяет плейсхолдеры в одном параграфе, в том числе разбитые между фрагментами"""
+    nodes = paragraph_text_nodes(p)
+    texts = [node.text or '' for node in nodes]
+    full_text = ''.join(texts)
+    if '{' not in full_text:
+        return False
+
+    hits = []
+    for match in PLACEHOLDER_PATTERN.finditer(full_text):
+        if match.group(0) in replacements:
+            hits.append(match)
+        else:
+            unresolved.setdefault(match.group(0), []).append((p, owner))
+    if not hits:
+        return False
+
+    starts = list(accumulate((len(text) for text in texts[:-1]), initial=0))
+    # С конца, чтобы смещения ещё не обработанных совпадений оставались верными
+    for match in reversed(hits):
+        start, end = match.span()
+        value = replacements[match.group(0)]
+        value = str(value) if value is not None else ""
+        first = bisect_right(starts, start) - 1
+        last = bisect_right(starts, end - 1) - 1
+        tail = texts[last][end - starts[last]:]
+        for k in range(first + 1, last + 1):
+            texts[k] = ''
+        texts[first] = texts[first][:start - starts[first]] + value + (tail if first == last else '')
+        if first != last:
+            texts[last] = tail
+
+    for node, text in zip(nodes, texts):
+        node.text = text
+        if text != text.strip():
+            node.set(qn('xml:space'), 'preserve')
+    for r in {id(node.getparent()): node.getparent() for node in nodes}.values():
+        Run(r, None).font.name = 'PF Centro Sans Pro'
+    return True
+
+def substitute_placeholders(doc, replacements, paragraphs=None):
+    """Заменяет все плейсхолдеры документа за один обход: тело, таблицы, колонтитулы и надписи.
+
+    paragraphs - заранее найденные пары (параграф, владелец), например из CompiledTemplate;
+    без них обходится весь документ.
+
+    Возвращает найденные, но не заменённые плейсхолдеры (например {chart})
+    в виде словаря плейсхолдер -> список пар (параграф, владелец).
+    """
+    unresolved = {}
+    if paragraphs is None:
+        paragraphs = [(p, owner) for root, owner in iter_story_roots(doc) for p in root.iter(qn('w:p'))]
+    for p, owner in paragraphs:
+        substitute_paragraph(p, replacements, unresolved, owner)
+    return unresolved
+
 def replace_placeholder(doc, placeholder, replacement):
     """Заменяет плейсхолдеры в документе, включая титульную страницу"""
-    replacement_str = str(replacement) if replacement is not None else ""
-    
-    for paragraph in doc.paragraphs:
-        if placeholder in paragraph.text:
-            paragraph.text = paragraph.text.replace(placeholder, replacement_str)
-            for run in paragraph.runs:
-                run.font.name = 'PF Centro Sans Pro'
-    
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                if placeholder in cell.text:
-                    cell.text = cell.text.replace(placeholder, replacement_str)
-                    for paragraph in cell.paragraphs:
-                        for run in paragraph.runs:
-                            run.font.name = 'PF Centro Sans Pro'
-
-def find_mitre_table(doc):
-    """Находит таблицу с тактиками и техниками MITRE ATT&CK по контексту"""
-    table_title = "Таблица 2. Тактики и техники"
-    
-    for paragraph in doc.paragraphs:
-        if table_title in paragraph.text:
-            for element in paragraph._element.xpath('./following::*'):
-                if element.tag.endswith('tbl'):
-                    for table in doc.tables:
-                        if table._element == element:
-                            return table
+    substitute_placeholders(doc, {placeholder: replacement})
+
+# Якоря таблиц шаблона: закладка или тег (надежнее) и подпись перед таблицей
+SOURCES_TABLE_ANCHORS = ("sources_table", "Таблица 1. Имена затронутых источников")
+MITRE_TABLE_ANCHORS = ("mitre_table", "Таблица 2. Тактики и техники")
+
+def normalize_anchor(text):
+    """Приводит подпись к ключу индекса: без лишних пробелов по краям и внутри"""
+    return ' '.join(text.split())
+
+def table_marks(element):
+    """Возвращает закладки и теги элемента: имена закладок, теги элементов управления
+    содержимым (w:sdt) и заголовок таблицы (замещающий текст, w:tblCaption)"""
+    marks = [b.get(qn('w:name')) for b in element.iter(qn('w:bookmarkStart'))]
+    marks += [t.get(qn('w:val')) for t in element.iter(qn('w:tag'), qn('w:tblCaption'))]
+    return [mark for mark in marks if mark]
+
+def build_table_index(doc):
+    """Строит за один проход по телу документа индекс якорь -> таблица.
+
+    Якорями таблицы считаются подписи (непустые параграфы) после предыдущей таблицы,
+    закладки и теги этих параграфов, а также закладки и теги внутри самой таблицы
+    или охватывающего ее элемента управления содержимым. При повторе побеждает
+    первая таблица, как при прежнем поиске по подписи.
+    """
+    index = {}
+    pending = []
+    for element in doc.element.body:
+        if element.tag == qn('w:p'):
+            text = normalize_anchor(''.join(node.text or '' for node in element.iter(qn('w:t'))))
+            if text:
+                pending.append(text)
+            pending.extend(table_marks(element))
+            continue
+
+        if element.tag == qn('w:tbl'):
+            tables = [element]
+        elif element.tag == qn('w:sdt'):
+            tables = element.findall(f"{qn('w:sdtContent')}/{qn('w:tbl')}")
+        else:
+            continue
+        if not tables:
+            # Элемент управления содержимым без таблицы - как обычный параграф
+            pending.extend(table_marks(element))
+            continue
+
+        table = Table(tables[0], doc._body)
+        for anchor in pending + table_marks(element):
+            index.setdefault(anchor, table)
+        pending = []
+    return index
+
+def find_table(doc, anchors, index=None):
+    """Находит таблицу по первому подходящему якорю (закладка, тег или подпись).
+
+    Подпись ищется сначала точно, затем как подстрока, чтобы поддержать
+    шаблоны с дополненными подписями.
+    """
+    if index is None:
+        index = build_table_index(doc)
+    for anchor in anchors:
+        table = index.get(normalize_anchor(anchor))
+        if table is not None:
+            return table
+    for anchor in anchors:
+        anchor = normalize_anchor(anchor)
+        for key, table in index.items():
+            if anchor in key:
+                return table
     return None
 
-def fill_mitre_table(doc, techniques, technique_to_tactic):
-    """Заполняет таблицу с тактиками и техниками MITRE ATT&CK"""
-    target_table = find_mitre_table(doc)
+def find_mitre_table(doc, index=None):
+    """Находит таблицу с тактиками и техниками MITRE ATT&CK по закладке, тегу или подписи"""
+    return find_table(doc, MITRE_TABLE_ANCHORS, index)
+
+def fill_mitre_table(doc, resolved, technique_to_tactic, target_table=None):
+    """Заполняет таблицу с тактиками и техниками MITRE ATT&CK.
+
+    resolved - результат resolve_techniques: правила листа 1-6 с тактиками
+    """
+    if target_table is None:
+        target_table = find_mitre_table(doc)
     
     if not target_table:
         print("Таблица с тактиками и техниками MITRE ATT&CK не найдена в шаблоне")
@@ -109,80 +326,179 @@ def fill_mitre_table(doc, techniques, technique_to_tactic):
     for row in list(target_table.rows)[1:]:
         target_table._tbl.remove(row._tr)
     
-    for technique in techniques:
-        tactic = technique_to_tactic.get(str(technique).strip() if technique else "", "Неизвестная тактика")
-        
-        new_row = target_table.add_row()
-        while len(new_row.cells) < 2:
-            new_row.add_cell()
-        
-        set_cell_text(new_row.cells[0], tactic)
-        set_cell_text(new_row.cells[1], technique)
-
-def create_tactics_chart(techniques, technique_to_tactic, output_dir, company_name):
-    """Создаёт столбчатую диаграмму распределения тактик MITRE ATT&CK"""
-    if not techniques:
-        print("Нет данных для построения диаграммы")
-        return None
+    # Сопоставление из CSV дополнительно знает техники MITRE для каждого правила
+    rule_techniques = getattr(technique_to_tactic, "rule_techniques", None)
+    technique_texts = {}
+    if rule_techniques:
+        # Техники ищутся один раз для каждого различного правила
+        for rule in resolved["rule"].cat.categories:
+            technique_ids = rule_techniques(rule)
+            if technique_ids:
+                technique_texts[rule] = f"{rule} ({', '.join(technique_ids)})"
     
-    tactic_count = defaultdict(int)
-    for tech in techniques:
-        tactic = technique_to_tactic.get(str(tech).strip(), "Неизвестная тактика")
-        tactic_count[tactic] += 1
+    rows = [(tactic, technique_texts.get(rule, rule))
+            for tactic, rule in zip(resolved["tactic"], resolved["rule"])]
     
-    if not tactic_count:
-        return None
+    append_table_rows(target_table, rows, min_cells=2)
+
+UNKNOWN_TACTIC = "Неизвестная тактика"
+
+# Последнее сопоставление-словарь в виде Series для векторного поиска
+_mapping_series = (None, None)
+
+def mapping_series(technique_to_tactic):
+    """Возвращает словарь сопоставления в виде Series (строится один раз на словарь)"""
+    global _mapping_series
+    if _mapping_series[0] is not technique_to_tactic:
+        _mapping_series = (technique_to_tactic, pd.Series(technique_to_tactic, dtype=object))
+    return _mapping_series[1]
+
+def resolve_techniques(techniques, technique_to_tactic):
+    """Сопоставляет все сработавшие правила с тактиками за один шаг.
+
+    Правила переводятся в категориальный столбец, и сопоставление выполняется
+    только для его различных значений: для словаря из rules.xlsx векторно,
+    для сопоставления из CSV - вызовом get() на каждое различное правило.
+    Возвращает DataFrame в порядке листа 1-6 со столбцами rule, tactic
+    (категориальные, тактики в порядке первого появления) и known.
+    """
+    rules = pd.Categorical(pd.Series(techniques, dtype=object).astype(str).str.strip())
+    categories = rules.categories
+    if isinstance(technique_to_tactic, dict):
+        category_tactics = categories.map(mapping_series(technique_to_tactic))
+    else:
+        category_tactics = pd.Index([technique_to_tactic.get(rule) for rule in categories], dtype=object)
+
+    tactics = category_tactics.take(rules.codes)
+    known = tactics.notna()
+    tactics = tactics.where(known, UNKNOWN_TACTIC)
+    return pd.DataFrame({
+        "rule": rules,
+        "tactic": pd.Categorical(tactics, categories=pd.unique(tactics)),
+        "known": known,
+    })
+
+def resolution_stats(resolved):
+    """Возвращает число правил, число правил без тактики и число различных таких правил"""
+    unknown = resolved.loc[~resolved["known"], "rule"]
+    return len(resolved), len(unknown), unknown.nunique()
+
+def group_techniques_by_tactic(resolved):
+    """Группирует сработавшие правила по тактикам.
+
+    Возвращает словарь тактика -> список правил; тактики идут в порядке первого появления.
+    Результат используют и диаграмма, и сводная таблица MITRE.
+    """
+    return {
+        tactic: group["rule"].tolist()
+        for tactic, group in resolved.groupby("tactic", sort=True, observed=True)
+    }
+
+def set_cell_runs_text(cell, text):
+    """Меняет текст ячейки, сохраняя оформление ее первого фрагмента"""
+    nodes = paragraph_text_nodes(cell.paragraphs[0]._p)
+    if not nodes:
+        set_cell_text(cell, text)
+        return
+    nodes[0].text = text
+    for node in nodes[1:]:
+        node.text = ''
+
+def fill_mitre_summary_table(doc, tactic_groups, target_table=None):
+    """Заполняет таблицу MITRE в сводном виде: строка на тактику с числом
+    сработавших правил и перечнем их кодов"""
+    if target_table is None:
+        target_table = find_mitre_table(doc)
+    
+    if not target_table:
+        print("Таблица с тактиками и техниками MITRE ATT&CK не найдена в шаблоне")
+        return
+    
+    for row in list(target_table.rows)[1:]:
+        target_table._tbl.remove(row._tr)
     
-    setup_matplotlib_font()
-    plt.figure(figsize=(12, 8))
-    tactics = list(tactic_count.keys())
-    counts = list(tactic_count.values())
+    header_cells = target_table.rows[0].cells
+    if len(header_cells) > 1:
+        set_cell_runs_text(header_cells[1], "Количество и коды правил")
     
-    bars = plt.bar(tactics, counts, color='skyblue')
-    plt.xlabel('Тактики MITRE ATT&CK', fontsize=12)
-    plt.ylabel('Количество правил', fontsize=12)
-    plt.title('Распределение правил по тактикам MITRE ATT&CK', fontsize=14)
-    plt.xticks(rotation=45, ha='right')
+    rows = []
+    # Сначала тактики с наибольшим числом правил
+    for tactic, rules in sorted(tactic_groups.items(), key=lambda item: -len(item[1])):
+        codes = list(dict.fromkeys(extract_rule_code(rule) or str(rule) for rule in rules))
+        rows.append((tactic, f"{len(rules)} ({', '.join(codes)})"))
+    
+    append_table_rows(target_table, rows, min_cells=2)
+
+@lru_cache(maxsize=64)
+def render_tactics_chart(histogram):
+    """Рисует диаграмму по кортежу пар (тактика, количество) и возвращает PNG.
+
+    Результат кэшируется: у многих клиентов распределение тактик совпадает.
+    """
+    font = setup_matplotlib_font("Regular")
+    tactics = [tactic for tactic, _ in histogram]
+    counts = [count for _, count in histogram]
+
+    # Объектный API без глобального состояния pyplot
+    fig = Figure(figsize=(12, 8))
+    ax = fig.subplots()
+    bars = ax.bar(tactics, counts, color='skyblue')
+    ax.set_xlabel('Тактики MITRE ATT&CK', **chart_text_font(font, 12))
+    ax.set_ylabel('Количество правил', **chart_text_font(font, 12))
+    ax.set_title('Распределение правил по тактикам MITRE ATT&CK', **chart_text_font(font, 14))
+    ax.tick_params(axis='x', labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment('right')
+        if font is not None:
+            label.set_fontproperties(font)
+    if font is not None:
+        for label in ax.get_yticklabels():
+            label.set_fontproperties(font)
     
     for bar, count in zip(bars, counts):
-        plt.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.1,
-                str(count), ha='center', va='bottom')
-    
-    plt.tight_layout()
-    
-    # Создаем безопасное имя файла для компании
-    safe_company_name = re.sub(r'[\\/*?:"<>|]', "_", company_name)
-    chart_path = os.path.join(output_dir, f"{safe_company_name}_tactics_chart.png")
-    
-    plt.savefig(chart_path, dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    return chart_path
-
-def replace_chart_placeholder(doc, chart_path):
-    """Заменяет плейсхолдер {chart} на диаграмму в документе"""
-    # Ищем плейсхолдер {chart} в параграфах
-    for paragraph in doc.paragraphs:
-        if "{chart}" in paragraph.text:
-            # Очищаем параграф и вставляем изображение
-            paragraph.text = ""
-            run = paragraph.add_run()
-            run.add_picture(chart_path, width=Inches(6))
-            paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            return True
-    
-    # Ищем плейсхолдер {chart} в таблицах
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                if "{chart}" in cell.text:
-                    # Очищаем ячейку и вставляем изображение
-                    cell.text = ""
-                    paragraph = cell.paragraphs[0]
-                    run = paragraph.add_run()
-                    run.add_picture(chart_path, width=Inches(6))
-                    paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                    return True
+        ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.1,
+                str(count), ha='center', va='bottom', **chart_text_font(font))
+    
+    fig.tight_layout()
+    
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=300, bbox_inches='tight')
+    return buffer.getvalue()
+
+def create_tactics_chart(resolved, tactic_groups=None):
+    """Создаёт столбчатую диаграмму распределения тактик MITRE ATT&CK в памяти.
+
+    resolved - результат resolve_techniques,
+    tactic_groups - уже выполненная группировка group_techniques_by_tactic
+    """
+    if resolved.empty:
+        print("Нет данных для построения диаграммы")
+        return None
+    
+    if tactic_groups is None:
+        tactic_groups = group_techniques_by_tactic(resolved)
+    
+    if not tactic_groups:
+        return None
+    
+    return io.BytesIO(render_tactics_chart(tuple((tactic, len(rules)) for tactic, rules in tactic_groups.items())))
+
+def replace_chart_placeholder(doc, chart_image, locations=None):
+    """Заменяет плейсхолдер {chart} на диаграмму в документе (путь к файлу или поток с PNG).
+
+    locations - найденные substitute_placeholders места плейсхолдера; без них документ обходится заново
+    """
+    if locations is None:
+        locations = substitute_placeholders(doc, {}).get("{chart}", [])
+    
+    for p, owner in locations:
+        # Очищаем параграф и вставляем изображение
+        paragraph = Paragraph(p, owner)
+        paragraph.text = ""
+        run = paragraph.add_run()
+        run.add_picture(chart_image, width=Inches(6))
+        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        return True
     
     print("Плейсхолдер {chart} не найден в документе")
     return False
@@ -204,22 +520,14 @@ def format_period(period_str):
         print(f"Ошибка форматирования периода: {e}")
         return str(period_str)
 
-def find_sources_table(doc):
-    """Находит таблицу с затронутыми источниками по контексту"""
-    table_title = "Таблица 1. Имена затронутых источников"
-    
-    for paragraph in doc.paragraphs:
-        if table_title in paragraph.text:
-            for element in paragraph._element.xpath('./following::*'):
-                if element.tag.endswith('tbl'):
-                    for table in doc.tables:
-                        if table._element == element:
-                            return table
-    return None
+def find_sources_table(doc, index=None):
+    """Находит таблицу с затронутыми источниками по закладке, тегу или подписи"""
+    return find_table(doc, SOURCES_TABLE_ANCHORS, index)
 
-def fill_sources_table(doc, assets):
+def fill_sources_table(doc, assets, target_table=None):
     """Заполняет таблицу с затронутыми источниками"""
-    target_table = find_sources_table(doc)
+    if target_table is None:
+        target_table = find_sources_table(doc)
     
     if not target_table:
         print("Таблица с затронутыми источниками не найдена в шаблоне")
@@ -228,68 +536,326 @@ def fill_sources_table(doc, assets):
     for row in list(target_table.rows)[1:]:
         target_table._tbl.remove(row._tr)
     
-    rows_needed = min(35, (len(assets) + 3) // 4)
-    
-    for _ in range(rows_needed):
-        new_row = target_table.add_row()
-        
-    for i in range(rows_needed):
-        row = target_table.rows[i + 1]
-        for j in range(4):
-            idx = i * 4 + j
-            if idx < len(assets):
-                if j*2 + 1 < len(row.cells):
-                    set_cell_text(row.cells[j*2], str(assets[idx][0]) if assets[idx][0] is not None else "")
-                    set_cell_text(row.cells[j*2 + 1], str(assets[idx][1]) if assets[idx][1] is not None else "")
-            else:
-                if j*2 + 1 < len(row.cells):
-                    set_cell_text(row.cells[j*2], '')
-                    set_cell_text(row.cells[j*2 + 1], '')
-
-def process_excel_file(excel_path, template_path, output_dir):
-    """Обрабатывает один Excel файл и генерирует отчет"""
-    try:
-        df_1_1 = pd.read_excel(excel_path, sheet_name="1-1", header=None, nrows=1)
-        company_name = str(df_1_1.iloc[0, 2]) if len(df_1_1.columns) > 2 and not pd.isna(df_1_1.iloc[0, 2]) else "[Название организации]"
-        events_count = str(df_1_1.iloc[0, 6]) if len(df_1_1.columns) > 6 and not pd.isna(df_1_1.iloc[0, 6]) else "[неизвестно]"
-        period = format_period(df_1_1.iloc[0, 1] if len(df_1_1.columns) > 1 else None)
-        
-        df_1_2 = pd.read_excel(excel_path, sheet_name="1-2", header=None, nrows=1)
-        alerts_count = str(df_1_2.iloc[0, 7]) if len(df_1_2.columns) > 7 and not pd.isna(df_1_2.iloc[0, 7]) else "[неизвестно]"
-        
-        try:
-            df_1_5 = pd.read_excel(excel_path, sheet_name="1-5", header=None, usecols="E", skiprows=2)
-            assets = [(i+1, str(val)) for i, val in enumerate(df_1_5.iloc[:, 0]) if not df_1_5.empty and not pd.isna(val)] if not df_1_5.empty else []
-        except Exception as e:
-            print(f"Ошибка при чтении листа 1-5: {e}")
-            assets = []
-        
-        try:
-            df_1_6 = pd.read_excel(excel_path, sheet_name="1-6", header=None, usecols="A", skiprows=2)
-            techniques = [str(val).strip() for val in df_1_6.iloc[:, 0] if not df_1_6.empty and not pd.isna(val)] if not df_1_6.empty else []
-        except Exception as e:
-            print(f"Ошибка при чтении листа 1-6: {e}")
-            techniques = []
-        
-    except Exception as e:
-        print(f"Ошибка при чтении Excel файла {excel_path}: {e}")
-        return
+    # По четыре источника (имя и адрес) в строке, без ограничения числа строк
+    rows = []
+    for i in range(0, len(assets), 4):
+        row = []
+        for asset in assets[i:i + 4]:
+            row.extend(asset[:2])
+        rows.append(row + [''] * (8 - len(row)))
+    
+    append_table_rows(target_table, rows)
+
+def element_path(root, element):
+    """Возвращает путь к элементу от корня в виде индексов дочерних элементов"""
+    path = []
+    while element is not root:
+        parent = element.getparent()
+        path.append(parent.index(element))
+        element = parent
+    return tuple(reversed(path))
+
+def resolve_path(root, path):
+    """Находит элемент по пути, полученному element_path"""
+    element = root
+    for index in path:
+        element = element[index]
+    return element
+
+def iter_package_parts(package):
+    """Обходит все части пакета DOCX по связям, каждую часть - один раз"""
+    seen = set()
+    stack = [package]
+    while stack:
+        source = stack.pop()
+        for rel in source.rels.values():
+            if rel.is_external or id(rel.target_part) in seen:
+                continue
+            seen.add(id(rel.target_part))
+            yield rel.target_part
+            stack.append(rel.target_part)
+
+def clone_package_object(obj, package):
+    """Копирует часть или пакет без закэшированных связей и ленивых свойств"""
+    clone = copy.copy(obj)
+    state = vars(clone)
+    for name in list(state):
+        if name == "_rels" or isinstance(getattr(type(obj), name, None), lazyproperty):
+            del state[name]
+    if package is not None:
+        clone._package = package
+    return clone
+
+# Части, которые отчет не изменяет: копии шаблона используют их XML совместно
+SHARED_PART_TYPES = (StylesPart, NumberingPart, SettingsPart, CorePropertiesPart)
+
+def clone_document(doc):
+    """Создает независимую копию документа.
+
+    Копируется XML документа и колонтитулов, остальные части и двоичные данные
+    (изображения шаблона) используются совместно: это дешевле повторной распаковки
+    и разбора файла шаблона.
+    """
+    package = doc.part.package
+    new_package = clone_package_object(package, None)
+    parts = list(iter_package_parts(package))
+    clones = {}
+    for part in parts:
+        clone = clone_package_object(part, new_package)
+        if isinstance(part, XmlPart) and not isinstance(part, SHARED_PART_TYPES):
+            clone._element = copy.deepcopy(part._element)
+        clones[id(part)] = clone
+
+    for source, target in [(package, new_package)] + [(part, clones[id(part)]) for part in parts]:
+        for rel in source.rels.values():
+            target_part = rel.target_ref if rel.is_external else clones[id(rel.target_part)]
+            target.rels.add_relationship(rel.reltype, target_part, rel.rId, rel.is_external)
+
+    # Собирает изображения шаблона, чтобы новые картинки получили свободные имена
+    new_package.after_unmarshal()
+    return new_package.main_document_part.document
 
+class TemplateDocument(NamedTuple):
+    """Копия шаблона для одного отчета с найденными плейсхолдерами и таблицами"""
+    document: object
+    placeholders: list
+    sources_table: object
+    mitre_table: object
+
+class CompiledTemplate:
+    """Шаблон отчета, разобранный один раз.
+
+    При разборе запоминаются пути к параграфам с плейсхолдерами (от корня их части:
+    документа или колонтитула) и к таблицам источников и MITRE; new_document() выдает
+    копию шаблона с уже найденными элементами, не обходя ее заново.
+    """
+
+    def __init__(self, template):
+        self.document = Document(template)
+
+        self.placeholder_paths = []
+        for root, owner in iter_story_roots(self.document):
+            part = owner.part
+            for p in root.iter(qn('w:p')):
+                text = ''.join(node.text or '' for node in paragraph_text_nodes(p))
+                if PLACEHOLDER_PATTERN.search(text):
+                    self.placeholder_paths.append((part.partname, element_path(part.element, p)))
+
+        body = self.document.element.body
+        table_index = build_table_index(self.document)
+        self.table_paths = {}
+        for name, find in (("sources", find_sources_table), ("mitre", find_mitre_table)):
+            table = find(self.document, table_index)
+            self.table_paths[name] = element_path(body, table._tbl) if table is not None else None
+
+    def new_document(self):
+        doc = clone_document(self.document)
+        parts = {part.partname: part for part in iter_package_parts(doc.part.package)}
+        placeholders = []
+        for partname, path in self.placeholder_paths:
+            part = parts[partname]
+            # Владелец параграфа нужен для вставки изображений; у колонтитула это его часть
+            owner = doc._body if part is doc.part else part
+            placeholders.append((resolve_path(part.element, path), owner))
+        tables = {
+            name: Table(resolve_path(doc.element.body, path), doc._body) if path is not None else None
+            for name, path in self.table_paths.items()
+        }
+        return TemplateDocument(doc, placeholders, tables["sources"], tables["mitre"])
+
+def load_mitre_mapping(mapping_path="rules.xlsx"):
+    """Загружает сопоставление правил и тактик MITRE из rules.xlsx"""
     try:
-        mitre_mapping = pd.read_excel("rules.xlsx", sheet_name="Sheet1")
-        technique_to_tactic = dict(zip(
+        mitre_mapping = pd.read_excel(mapping_path, sheet_name="Sheet1")
+        # Правила без тактики считаются неизвестными, а не получают тактику 'nan'
+        mitre_mapping = mitre_mapping.dropna(subset=['MITRE_Tactic'])
+        return dict(zip(
             mitre_mapping['Original_Rule'].astype(str).str.strip(),
             mitre_mapping['MITRE_Tactic'].astype(str)
         ))
     except Exception as e:
         print(f"Ошибка при чтении файла сопоставления MITRE: {e}")
-        technique_to_tactic = {}
+        return {}
+
+# Кэш сопоставлений: путь -> (размер и mtime, хэш содержимого, словарь)
+_mapping_cache = {}
+
+def get_mitre_mapping(mapping_path="rules.xlsx"):
+    """Возвращает сопоставление из кэша, перечитывая файл только после его изменения"""
+    try:
+        stat = os.stat(mapping_path)
+    except OSError:
+        return load_mitre_mapping(mapping_path)
+
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    cached = _mapping_cache.get(mapping_path)
+    if cached and cached[0] == stamp:
+        return cached[2]
+
+    # Время изменения сменилось - сверяем содержимое, прежде чем читать Excel заново
+    digest = file_digest(mapping_path)
+    if cached and cached[1] == digest:
+        _mapping_cache[mapping_path] = (stamp, digest, cached[2])
+        return cached[2]
+
+    mapping = load_mitre_mapping(mapping_path)
+    if mapping:
+        _mapping_cache[mapping_path] = (stamp, digest, mapping)
+    return mapping
+
+def load_report_mapping(mapping_source="xlsx"):
+    """Возвращает сопоставление правил: из rules.xlsx или напрямую из CSV-файлов D001/D002"""
+    if mapping_source == "csv":
+        try:
+            return load_rule_mapping()
+        except Exception as e:
+            print(f"Ошибка при чтении CSV-файлов сопоставления MITRE: {e}")
+            return {}
+    return get_mitre_mapping()
+
+class ReportData(NamedTuple):
+    """Данные обработанной выгрузки, необходимые для отчета"""
+    company_name: str
+    period: str
+    events_count: str
+    alerts_count: str
+    assets: list
+    techniques: list
+
+def is_empty_value(value):
+    """Проверяет, считается ли значение ячейки пустым"""
+    return value is None or value == ""
+
+def cell_text(value):
+    """Приводит значение ячейки к строке (целые числа - без дробной части, как в pandas)"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def first_row_value(ws, col_idx):
+    """Возвращает значение ячейки первой строки листа (нумерация столбцов с 0)"""
+    for row in ws.iter_rows(min_row=1, max_row=1, values_only=True):
+        return row[col_idx] if col_idx < len(row) else None
+    return None
+
+def read_column(ws, col_idx):
+    """Возвращает пары (номер строки данных, значение) столбца начиная с 3 строки"""
+    values = []
+    for i, (value,) in enumerate(ws.iter_rows(min_row=3, min_col=col_idx, max_col=col_idx, values_only=True)):
+        if not is_empty_value(value):
+            values.append((i + 1, value))
+    return values
+
+def report_data_from_workbook(wb, source_name):
+    """Извлекает данные для отчета из открытой книги: прочитанной с диска
+    или построенной в памяти скриптом пересортировки"""
+    try:
+        ws = wb["1-1"]
+        company = first_row_value(ws, 2)
+        events = first_row_value(ws, 6)
+        period = format_period(first_row_value(ws, 1))
+        company_name = cell_text(company) if not is_empty_value(company) else "[Название организации]"
+        events_count = cell_text(events) if not is_empty_value(events) else "[неизвестно]"
+
+        alerts = first_row_value(wb["1-2"], 7)
+        alerts_count = cell_text(alerts) if not is_empty_value(alerts) else "[неизвестно]"
+    except Exception as e:
+        print(f"Ошибка при чтении Excel файла {source_name}: {e}")
+        return None
+
+    try:
+        assets = [(i, cell_text(value)) for i, value in read_column(wb["1-5"], 5)]
+    except Exception as e:
+        print(f"Ошибка при чтении листа 1-5: {e}")
+        assets = []
 
     try:
-        doc = Document(template_path)
+        techniques = [cell_text(value).strip() for _, value in read_column(wb["1-6"], 1)]
+    except Exception as e:
+        print(f"Ошибка при чтении листа 1-6: {e}")
+        techniques = []
+
+    return ReportData(company_name, period, events_count, alerts_count, assets, techniques)
+
+def read_report_data(excel_path):
+    """Читает все нужные для отчета данные, открывая книгу один раз в потоковом режиме"""
+    try:
+        wb = load_workbook(excel_path, read_only=True, data_only=True)
+    except Exception as e:
+        print(f"Ошибка при чтении Excel файла {excel_path}: {e}")
+        return None
+
+    try:
+        return report_data_from_workbook(wb, excel_path)
+    finally:
+        wb.close()
+
+def process_excel_file(excel_path, template_path, output_dir, technique_to_tactic=None, mitre_table="rules",
+                       cache=None):
+    """Обрабатывает один Excel файл и генерирует отчет.
+
+    template_path может быть путем к шаблону, файловым объектом с его содержимым
+    или заранее разобранным CompiledTemplate,
+    technique_to_tactic - заранее загруженным сопоставлением (иначе берется из кэша rules.xlsx),
+    mitre_table - вид таблицы MITRE: "rules" (строка на правило) или "tactics" (строка на тактику),
+    cache - кэш результатов (ResultCache), созданный с report_cache_context
+    """
+    base_name = os.path.basename(excel_path)
+    report_name = os.path.splitext(base_name)[0] + "_report.docx"
+    output_path = os.path.join(output_dir, report_name)
+
+    if cache is not None:
+        with span("cache"):
+            try:
+                key = cache.key(excel_path)
+                cached = cache.fetch(key, output_path)
+            except Exception as e:
+                print(f"Ошибка при чтении Excel файла {excel_path}: {e}")
+                return False
+            if cached:
+                print(f"Данные не изменились, отчет взят из кэша: {output_path}")
+                return True
+
+    with span("read"):
+        data = read_report_data(excel_path)
+    if data is None:
+        return False
+
+    success = render_report(data, template_path, output_path, technique_to_tactic, mitre_table)
+    if success and cache is not None:
+        cache.store(key, output_path)
+    return success
+
+def report_cache_context(mapping_source="xlsx", mitre_table="rules", template_path="template.docx"):
+    """Возвращает общие для всех отчетов запуска части ключа кэша: версию кода
+    и библиотек, хэши шаблона и привязок, параметры и отчетный период"""
+    if mapping_source == "csv":
+        mapping_digests = (optional_digest(TACTICS_CSV), optional_digest(TECHNIQUES_CSV))
+    else:
+        mapping_digests = (optional_digest("rules.xlsx"),)
+    return (
+        code_version(__file__, rule_mapping.__file__, font_registry.__file__),
+        docx.__version__, matplotlib.__version__, pd.__version__,
+        optional_digest(template_path), mapping_source, *mapping_digests, mitre_table,
+        # Месяц и год подставляются в отчет из текущей даты
+        get_russian_month(), datetime.now().year,
+    )
+
+def render_report(data, template_path, output_path, technique_to_tactic=None, mitre_table="rules"):
+    """Формирует отчет DOCX по уже прочитанным данным (ReportData); параметры - как у process_excel_file"""
+    company_name, period, events_count, alerts_count, assets, techniques = data
+
+    if technique_to_tactic is None:
+        technique_to_tactic = get_mitre_mapping()
+
+    try:
+        template = template_path if isinstance(template_path, CompiledTemplate) else CompiledTemplate(template_path)
     except Exception as e:
         print(f"Ошибка при загрузке шаблона DOCX: {e}")
-        return
+        return False
+    with span("template"):
+        report = template.new_document()
+    doc = report.document
 
     replace_data = {
         "{предпр}": company_name,
@@ -302,33 +868,73 @@ def process_excel_file(excel_path, template_path, output_dir):
         "{период}": period
     }
     
-    for placeholder, value in replace_data.items():
-        replace_placeholder(doc, placeholder, value)
+    with span("placeholders"):
+        unresolved = substitute_placeholders(doc, replace_data, report.placeholders)
 
-    fill_sources_table(doc, assets)
-    fill_mitre_table(doc, techniques, technique_to_tactic)
+    with span("sources_table"):
+        if report.sources_table is not None:
+            fill_sources_table(doc, assets, report.sources_table)
+        else:
+            print("Таблица с затронутыми источниками не найдена в шаблоне")
+    # Правила сопоставляются с тактиками один раз; таблица и диаграмма используют результат
+    with span("resolve"):
+        resolved = resolve_techniques(techniques, technique_to_tactic)
+        total, unknown, unknown_unique = resolution_stats(resolved)
+        tactic_groups = group_techniques_by_tactic(resolved)
+    if unknown:
+        print(f"Правил без привязки к тактике MITRE: {unknown} из {total} (различных: {unknown_unique})")
+    with span("mitre_table"):
+        if report.mitre_table is None:
+            print("Таблица с тактиками и техниками MITRE ATT&CK не найдена в шаблоне")
+        elif mitre_table == "tactics":
+            fill_mitre_summary_table(doc, tactic_groups, report.mitre_table)
+        else:
+            fill_mitre_table(doc, resolved, technique_to_tactic, report.mitre_table)
     
     # Создаем и вставляем диаграмму вместо плейсхолдера {chart}
-    chart_path = create_tactics_chart(techniques, technique_to_tactic, output_dir, company_name)
-    if chart_path:
-        replace_chart_placeholder(doc, chart_path)
-        # Удаляем временный файл диаграммы
-        try:
-            os.remove(chart_path)
-        except Exception as e:
-            print(f"Ошибка при удалении временного файла диаграммы: {e}")
+    with span("chart"):
+        chart_image = create_tactics_chart(resolved, tactic_groups)
+        if chart_image:
+            replace_chart_placeholder(doc, chart_image, unresolved.get("{chart}", []))
    
-    base_name = os.path.basename(excel_path)
-    report_name = os.path.splitext(base_name)[0] + "_report.docx"
-    output_path = os.path.join(output_dir, report_name)
-
     try:
-        doc.save(output_path)
+        with span("save"):
+            doc.save(output_path)
         print(f"Отчет успешно сгенерирован: {output_path}")
+        return True
     except Exception as e:
         print(f"Ошибка при сохранении отчета: {e}")
+        return False
+
+# Общие данные рабочего процесса, передаются один раз при его запуске
+_worker_state = {}
+
+def init_report_worker(template_bytes, technique_to_tactic, mitre_table="rules", timing_settings=(), cache=None):
+    """Разбирает в рабочем процессе шаблон и сохраняет сопоставление MITRE и кэш результатов (только для чтения)"""
+    init_worker(*timing_settings)
+    # Шрифты берутся из реестра, унаследованного от родителя или из его кэша
+    load_font_registry()
+    _worker_state["template"] = CompiledTemplate(io.BytesIO(template_bytes))
+    _worker_state["technique_to_tactic"] = technique_to_tactic
+    _worker_state["mitre_table"] = mitre_table
+    _worker_state["cache"] = cache
 
-def generate_reports():
+def process_excel_file_in_worker(excel_path, output_dir):
+    """Генерирует отчет в рабочем процессе; возвращает результат, время, вывод и замеры этапов"""
+    buffer = io.StringIO()
+    started = time.perf_counter()
+    with redirect_stdout(buffer), file_scope(excel_path):
+        success = process_excel_file(
+            excel_path,
+            _worker_state["template"],
+            output_dir,
+            _worker_state["technique_to_tactic"],
+            _worker_state["mitre_table"],
+            _worker_state["cache"]
+        )
+    return success, time.perf_counter() - started, buffer.getvalue(), take_spans()
+
+def generate_reports(jobs=1, mapping_source="xlsx", mitre_table="rules", cache=None):
     if not os.path.exists("output"):
         print("Каталог 'output' не существует")
         return
@@ -345,10 +951,61 @@ def generate_reports():
         print("В каталоге 'output' не найдено Excel файлов")
         return
     
-    for excel_file in excel_files:
-        excel_path = os.path.join("output", excel_file)
-        print(f"Обработка файла: {excel_path}")
-        process_excel_file(excel_path, "template.docx", "reports")
+    started = time.perf_counter()
+    success_count = 0
+
+    if jobs > 1 and len(excel_files) > 1:
+        # Шаблон и сопоставление читаются один раз и передаются рабочим процессам
+        with open("template.docx", "rb") as f:
+            template_bytes = f.read()
+        with span("mapping"):
+            technique_to_tactic = load_report_mapping(mapping_source)
+        load_font_registry()
+
+        tasks = {}
+        for excel_file in excel_files:
+            excel_path = os.path.join("output", excel_file)
+            tasks[excel_path] = (excel_path, "reports")
+        success_count = run_in_pool(
+            process_excel_file_in_worker, tasks, jobs, init_report_worker,
+            (template_bytes, technique_to_tactic, mitre_table, profiling_settings(), cache)
+        )
+    else:
+        with span("mapping"):
+            technique_to_tactic = load_report_mapping(mapping_source)
+        # Шаблон разбирается один раз, для каждого отчета создается его копия
+        try:
+            with span("compile_template"):
+                template = CompiledTemplate("template.docx")
+        except Exception as e:
+            print(f"Ошибка при загрузке шаблона DOCX: {e}")
+            return
+        for excel_file in excel_files:
+            excel_path = os.path.join("output", excel_file)
+            print(f"Обработка файла: {excel_path}")
+            file_started = time.perf_counter()
+            with file_scope(excel_path):
+                success_count += bool(process_excel_file(excel_path, template, "reports", technique_to_tactic,
+                                                             mitre_table, cache))
+            print(f"Время обработки: {time.perf_counter() - file_started:.2f} с")
+
+    print(f"Сформировано отчетов: {success_count} из {len(excel_files)} за {time.perf_counter() - started:.2f} с")
 
 if __name__ == "__main__":
-    generate_reports()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Формирование отчетов DOCX по файлам из каталога output")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="число параллельных процессов (0 - по числу ядер)")
+    parser.add_argument("--mapping", choices=["xlsx", "csv"], default="xlsx",
+                        help="источник привязок MITRE: rules.xlsx или CSV-файлы D001/D002")
+    parser.add_argument("--mitre-table", choices=["rules", "tactics"], default="rules",
+                        help="таблица MITRE: строка на каждое правило или сводка по тактикам с числом правил")
+    add_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+
+    configure_profiling(args.profile, args.profile_dir)
+    cache = open_cache(args, "make_rep", *report_cache_context(args.mapping, args.mitre_table))
+    generate_reports(args.jobs if args.jobs > 0 else (os.cpu_count() or 1), args.mapping, args.mitre_table, cache)
+    close_cache(args)
+    if args.timings:
+        write_report(args.timings, "make_rep")
@@ -0,0 +1,278 @@
+"""Замеры производительности скриптов на синтетических выгрузках KUMA.
+
+Для каждого размера выгрузки (--rows) создается синтетическая книга
+(synthetic_export.py), и каждый замер выполняется --rounds раз после
+--warmup разогревочных запусков. Время подготовки данных (загрузка книги
+перед reorder_columns и т.п.) в замер не входит.
+
+Результаты (минимум, медиана, среднее, разброс и строк в секунду по медиане)
+сохраняются в benchmarks/<имя>.json (--save) и сравниваются с ранее
+сохраненными (--compare): медиана, выросшая больше чем на --threshold,
+считается замедлением, и скрипт завершается с кодом 1.
+
+Запуск: python benchmark.py --rows 10 1000 100000 --save 1.3
+        python benchmark.py --rows 10 1000 100000 --compare 1.3
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import openpyxl
+from openpyxl import load_workbook
+
+from font_registry import FONT_DIR
+from pipeline import SCRIPT_DIR, TEMPLATE_FILE, make_rep, reordering, take_rules
+from rule_mapping import TACTICS_CSV, TECHNIQUES_CSV
+from synthetic_export import write_synthetic_export
+
+BENCHMARK_DIR = "benchmarks"
+DEFAULT_ROWS = (10, 1000, 10000)
+DISTRIBUTION_SHEET = "Распределение ал"
+# Файлы, которые скрипты ищут в текущем каталоге
+RESOURCES = (TEMPLATE_FILE, take_rules.MITRE_FILE, TACTICS_CSV, TECHNIQUES_CSV, FONT_DIR)
+
+
+def check(success, case):
+    """Прерывает замер, если функция сообщила об ошибке (иначе замерялась бы обработка ошибки)"""
+    if success is False:
+        raise RuntimeError(f"Замер {case} завершился ошибкой")
+
+
+def case_process_workbook(export_path, processed_path):
+    return None, lambda _: check(reordering.process_workbook(export_path, processed_path), "process_workbook")
+
+
+def case_process_workbook_streaming(export_path, processed_path):
+    streamed_path = processed_path.replace("processed_", "streamed_")
+    return None, lambda _: check(reordering.process_workbook(export_path, streamed_path, streaming=True),
+                                 "process_workbook_streaming")
+
+
+def case_reorder_columns(export_path, processed_path):
+    def run(wb):
+        for sheet_name, order in reordering.COLUMN_ORDER.items():
+            reordering.reorder_columns(wb[sheet_name], order)
+    return lambda: load_workbook(export_path), run
+
+
+def case_filter_distribution_alerts(export_path, processed_path):
+    def setup():
+        ws = load_workbook(export_path)[DISTRIBUTION_SHEET]
+        reordering.reorder_columns(ws, reordering.COLUMN_ORDER[DISTRIBUTION_SHEET])
+        return ws
+    return setup, reordering.filter_distribution_alerts
+
+
+def case_take_rules_main(export_path, processed_path):
+    def setup():
+        # rules.xlsx удаляется, чтобы проверить, что его создал именно этот запуск
+        if os.path.exists("rules.xlsx"):
+            os.remove("rules.xlsx")
+
+    def run(_):
+        take_rules.main()
+        check(os.path.exists("rules.xlsx"), "take_rules.main")
+    return setup, run
+
+
+def case_process_excel_file(export_path, processed_path, warm_chart=False):
+    template = make_rep.CompiledTemplate(TEMPLATE_FILE)
+    mapping = make_rep.load_mitre_mapping()
+
+    def run(_):
+        check(make_rep.process_excel_file(processed_path, template, "reports", mapping), "process_excel_file")
+
+    def setup():
+        # Каждый раунд строит тот же отчет: без сброса кэша диаграмм после разогрева
+        # замерялась бы только выдача готовой диаграммы, а не ее отрисовка
+        if not warm_chart:
+            make_rep.render_tactics_chart.cache_clear()
+        elif not make_rep.render_tactics_chart.cache_info().currsize:
+            run(None)
+    return setup, run
+
+
+def case_process_excel_file_warm_chart(export_path, processed_path):
+    return case_process_excel_file(export_path, processed_path, warm_chart=True)
+
+
+# Замеры в порядке выполнения: take_rules.main и process_excel_file
+# используют книгу, сохраненную process_workbook; process_excel_file_warm_chart -
+# то же формирование отчета, но с готовой диаграммой из кэша render_tactics_chart
+CASES = {
+    "process_workbook": case_process_workbook,
+    "process_workbook_streaming": case_process_workbook_streaming,
+    "reorder_columns": case_reorder_columns,
+    "filter_distribution_alerts": case_filter_distribution_alerts,
+    "take_rules.main": case_take_rules_main,
+    "process_excel_file": case_process_excel_file,
+    "process_excel_file_warm_chart": case_process_excel_file_warm_chart,
+}
+
+
+def measure(setup, run, rounds, warmup):
+    """Возвращает время каждого из rounds запусков run(setup()) в секундах"""
+    times = []
+    for i in range(warmup + rounds):
+        data = setup() if setup else None
+        started = time.perf_counter()
+        run(data)
+        elapsed = time.perf_counter() - started
+        if i >= warmup:
+            times.append(elapsed)
+    return times
+
+
+def summarize(times, rows):
+    median = statistics.median(times)
+    return {
+        "rows": rows,
+        "rounds": len(times),
+        "min": round(min(times), 6),
+        "median": round(median, 6),
+        "mean": round(statistics.mean(times), 6),
+        "stddev": round(statistics.stdev(times), 6) if len(times) > 1 else 0.0,
+        "rows_per_second": round(rows / median, 1) if median else None,
+    }
+
+
+def prepare_workdir(workdir):
+    """Копирует в рабочий каталог шаблон, привязки и шрифты: скрипты ищут их в текущем каталоге"""
+    for name in RESOURCES:
+        source = os.path.join(SCRIPT_DIR, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(workdir, name))
+        elif os.path.exists(source):
+            shutil.copy(source, workdir)
+    for name in ("INPUT", "output", "reports"):
+        os.makedirs(os.path.join(workdir, name))
+
+
+def run_benchmarks(rows_list, cases, rounds=5, warmup=1, seed=1, no_data=()):
+    """Выполняет замеры во временном каталоге; возвращает словарь 'замер[строк]' -> сводка"""
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="kuma_bench_") as workdir:
+        prepare_workdir(workdir)
+        os.chdir(workdir)
+        try:
+            for rows in rows_list:
+                export_path = os.path.join("INPUT", f"synthetic_{rows}.xlsx")
+                processed_path = os.path.join("output", f"processed_synthetic_{rows}.xlsx")
+                # take_rules.main читает все processed-файлы каталога output
+                for name in os.listdir("output"):
+                    os.remove(os.path.join("output", name))
+                print(f"Создание выгрузки на {rows} строк...")
+                write_synthetic_export(export_path, rows, no_data, seed)
+
+                for case in cases:
+                    # Вывод скриптов не печатается, чтобы не влиять на замер
+                    with redirect_stdout(io.StringIO()):
+                        setup, run = CASES[case](export_path, processed_path)
+                        times = measure(setup, run, rounds, warmup)
+                    results[f"{case}[{rows}]"] = summarize(times, rows)
+                    print_result(f"{case}[{rows}]", results[f"{case}[{rows}]"])
+                os.remove(export_path)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def print_result(name, result, baseline=None):
+    line = (f"{name:<40} {result['min']:>10.4f} {result['median']:>10.4f} "
+            f"{result['stddev']:>9.4f} {result['rows_per_second'] or 0:>12,.0f}")
+    if baseline:
+        line += f" {result['median'] / baseline['median'] - 1:>+8.1%}"
+    print(line)
+
+
+def machine_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "openpyxl": openpyxl.__version__,
+    }
+
+
+def baseline_path(name):
+    return os.path.join(BENCHMARK_DIR, name + ".json")
+
+
+def save_results(name, results):
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    path = baseline_path(name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "machine": machine_info(),
+            "results": results,
+        }, f, ensure_ascii=False, indent=1)
+    print(f"Результаты сохранены: {path}")
+
+
+def compare_results(name, results, threshold):
+    """Сравнивает медианы с сохраненными; возвращает список замедлившихся замеров"""
+    with open(baseline_path(name), encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nСравнение с {baseline_path(name)} от {baseline['created']} "
+          f"(Python {baseline['machine']['python']}, openpyxl {baseline['machine']['openpyxl']}):")
+    regressions = []
+    for case, result in results.items():
+        base = baseline["results"].get(case)
+        if base is None:
+            continue
+        print_result(case, result, base)
+        if result["median"] > base["median"] * (1 + threshold):
+            regressions.append(case)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности на синтетических выгрузках KUMA")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(DEFAULT_ROWS),
+                        help="размеры выгрузок, строк на лист (от 10 до 1000000)")
+    parser.add_argument("--case", nargs="+", choices=list(CASES), default=list(CASES),
+                        help="выполняемые замеры (по умолчанию все)")
+    parser.add_argument("--rounds", type=int, default=5, help="число замеряемых запусков")
+    parser.add_argument("--warmup", type=int, default=1, help="число разогревочных запусков")
+    parser.add_argument("--seed", type=int, default=1, help="начальное значение генератора выгрузок")
+    parser.add_argument("--no-data", nargs="*", default=(), metavar="ЛИСТ",
+                        help="листы выгрузки с 'No Data' (all - все листы)")
+    parser.add_argument("--save", metavar="ИМЯ", help=f"сохранить результаты в {BENCHMARK_DIR}/ИМЯ.json")
+    parser.add_argument("--compare", metavar="ИМЯ", help=f"сравнить с {BENCHMARK_DIR}/ИМЯ.json")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="допустимый рост медианы при сравнении (0.2 - на 20%%)")
+    args = parser.parse_args()
+
+    # take_rules.main и process_excel_file работают с книгой, созданной process_workbook
+    cases = [case for case in CASES if case in args.case]
+    if {"take_rules.main", "process_excel_file", "process_excel_file_warm_chart"} & set(cases) and "process_workbook" not in cases:
+        cases.insert(0, "process_workbook")
+
+    print(f"{'Замер':<40} {'Мин, с':>10} {'Медиана, с':>10} {'Разброс':>9} {'Строк/с':>12}")
+    no_data = "all" if "all" in args.no_data else args.no_data
+    results = run_benchmarks(args.rows, cases, args.rounds, args.warmup, args.seed, no_data)
+
+    if args.save:
+        save_results(args.save, results)
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+        if regressions:
+            print(f"Замедление больше {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("Замедлений не обнаружено")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Реестр шрифтов PF Centro Sans Pro для диаграмм matplotlib"""
+import dataclasses
+import json
+import os
+
+import matplotlib
+from matplotlib import font_manager
+
+FONT_DIR = "PFCentroSansPro"
+
+# Кэш описаний шрифтов: при следующих запусках файлы шрифтов не разбираются заново.
+# Каталог кэша matplotlib переживает обновления библиотеки, поэтому кэш помечается ее версией
+CACHE_FILE = os.path.join(matplotlib.get_cachedir(), "pfcentro-font-registry.json")
+CACHE_VERSION = 1
+
+# Начертание (Regular, Bold, ...) -> описания шрифта, зарегистрированные в matplotlib
+_registry = None
+
+
+def style_name(path):
+    """Возвращает начертание по имени файла: PFCentroSansPro-BoldItalic.ttf -> BoldItalic"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem.rsplit('-', 1)[-1]
+
+
+def scan_fonts(font_dir):
+    """Разбирает файлы шрифтов каталога в детерминированном (алфавитном) порядке"""
+    manager = font_manager.fontManager
+    styles = {}
+    for file in sorted(os.listdir(font_dir)):
+        if not file.lower().endswith(('.ttf', '.otf')):
+            continue
+        path = os.path.abspath(os.path.join(font_dir, file))
+        registered = len(manager.ttflist)
+        manager.addfont(path)
+        styles[style_name(path)] = manager.ttflist[registered:]
+    return styles
+
+
+def load_cache(font_dir, stamp):
+    """Читает кэш описаний шрифтов; None, если кэша нет, каталог или версия matplotlib
+    изменились либо описания не удалось восстановить"""
+    try:
+        with open(CACHE_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (not isinstance(data, dict) or data.get("version") != CACHE_VERSION or data.get("matplotlib") != matplotlib.__version__
+            or data.get("dir") != os.path.abspath(font_dir) or data.get("stamp") != stamp):
+        return None
+    try:
+        styles = {
+            style: [font_manager.FontEntry(**fields) for fields in entries]
+            for style, entries in data["styles"].items()
+        }
+        if not all(os.path.exists(entry.fname) for entries in styles.values() for entry in entries):
+            return None
+    except Exception:
+        # Поля FontEntry другой версии matplotlib или поврежденный кэш - шрифты разбираются заново
+        return None
+    return styles
+
+
+def save_cache(font_dir, stamp, styles):
+    """Сохраняет описания шрифтов; ошибка записи не мешает работе"""
+    data = {
+        "version": CACHE_VERSION,
+        "matplotlib": matplotlib.__version__,
+        "dir": os.path.abspath(font_dir),
+        "stamp": stamp,
+        "styles": {
+            style: [dataclasses.asdict(entry) for entry in entries]
+            for style, entries in styles.items()
+        },
+    }
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        temp_path = f"{CACHE_FILE}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, CACHE_FILE)
+    except OSError as e:
+        print(f"Не удалось сохранить кэш шрифтов: {e}")
+
+
+def load_font_registry(font_dir=FONT_DIR):
+    """Регистрирует все начертания каталога в matplotlib (один раз на процесс)"""
+    global _registry
+    if _registry is not None:
+        return _registry
+
+    if not os.path.isdir(font_dir):
+        _registry = {}
+        return _registry
+
+    # Добавление и удаление файлов меняет время изменения каталога
+    stamp = os.stat(font_dir).st_mtime_ns
+    styles = load_cache(font_dir, stamp)
+    if styles is None:
+        styles = scan_fonts(font_dir)
+        save_cache(font_dir, stamp, styles)
+    else:
+        manager = font_manager.fontManager
+        for entries in styles.values():
+            manager.ttflist.extend(entries)
+        # Сбрасываем результаты поиска шрифтов, сделанные до регистрации
+        if hasattr(manager, "_findfont_cached"):
+            manager._findfont_cached.cache_clear()
+
+    _registry = styles
+    return _registry
+
+
+def font_properties(style="Regular", font_dir=FONT_DIR):
+    """Возвращает FontProperties начертания по имени (Regular, Bold, ...) или None"""
+    entries = load_font_registry(font_dir).get(style)
+    if not entries:
+        return None
+    return font_manager.FontProperties(fname=entries[0].fname)
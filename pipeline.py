@@ -0,0 +1,403 @@
+"""Сквозное формирование отчетов в памяти: пересортировка -> привязка правил к MITRE -> DOCX.
+
+Выгрузки KUMA из INPUT обрабатываются по одной, данные передаются между этапами
+без промежуточных файлов processed_*.xlsx и rules.xlsx. С ключом --keep-xlsx
+обработанные книги дополнительно сохраняются в OUTPUT для отладки.
+
+С ключом --watch скрипт работает как служба: следит за каталогом INPUT
+и формирует отчет по каждой новой или измененной выгрузке, как только
+она полностью записана.
+"""
+import argparse
+import importlib.util
+import io
+import os
+import signal
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from rule_mapping import TACTICS_CSV, TECHNIQUES_CSV
+from pipeline_timing import (add_arguments, configure_profiling, file_scope, init_worker,
+                             profiling_settings, span, take_spans, write_report)
+from worker_pool import print_output, run_in_pool
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_FILE = "template.docx"
+REPORTS_DIR = "reports"
+# Сколько раз отдельная от других обработка выгрузки может закончиться аварийным
+# завершением рабочего процесса (например, из-за нехватки памяти), прежде чем
+# режим --watch ее пропустит
+MAX_WORKER_CRASHES = 2
+
+
+def load_script(name, file_name):
+    """Загружает пронумерованный скрипт как модуль (имя файла с пробелом не импортируется обычным образом)"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+reordering = load_script("reordering", "1. reordering_v1.3.py")
+take_rules = load_script("take_rules", "2. take_rules.py")
+make_rep = load_script("make_rep", "3. make_rep.py")
+
+
+def tenant_mapping(techniques, rule_mapping, mitre_index):
+    """Возвращает сопоставление сработавших правил тенанта с тактиками.
+
+    Сопоставление из CSV используется напрямую (как make_rep.py --mapping csv),
+    для MITRE.xlsx строится словарь из тех же строк, которые take_rules.py
+    записал бы в rules.xlsx.
+    """
+    if rule_mapping is not None:
+        return rule_mapping
+    rows = take_rules.build_rule_rows(set(techniques), None, mitre_index)
+    return {str(row[0]).strip(): row[3] for row in rows if row[3] is not None}
+
+
+def report_path(input_path):
+    """Возвращает путь к отчету по выгрузке (как у make_rep.py для processed-файла)"""
+    processed_name = "processed_" + os.path.basename(input_path)
+    return os.path.join(REPORTS_DIR, os.path.splitext(processed_name)[0] + "_report.docx")
+
+
+def process_tenant(input_path, template, rule_mapping, mitre_index, mitre_table="rules", keep_xlsx=False):
+    """Формирует отчет по одной выгрузке KUMA, не записывая промежуточных файлов"""
+    processed_name = "processed_" + os.path.basename(input_path)
+    try:
+        wb = reordering.build_processed_workbook(input_path)
+    except Exception as e:
+        print(f"Ошибка при обработке файла {input_path}: {e}")
+        return False
+
+    try:
+        if keep_xlsx:
+            with span("save_xlsx"):
+                wb.save(os.path.join(reordering.OUTPUT_DIR, processed_name))
+        with span("read"):
+            data = make_rep.report_data_from_workbook(wb, processed_name)
+    finally:
+        wb.close()
+    if data is None:
+        return False
+
+    with span("mapping"):
+        technique_to_tactic = tenant_mapping(data.techniques, rule_mapping, mitre_index)
+    return make_rep.render_report(data, template, report_path(input_path), technique_to_tactic, mitre_table)
+
+
+# Общие данные рабочего процесса, передаются один раз при его запуске
+_worker_state = {}
+
+
+def init_pipeline_worker(template_bytes, rule_mapping, mitre_index, mitre_table, keep_xlsx, timing_settings=()):
+    """Разбирает в рабочем процессе шаблон и сохраняет источник привязок (только для чтения)"""
+    init_worker(*timing_settings)
+    make_rep.load_font_registry()
+    _worker_state["template"] = make_rep.CompiledTemplate(io.BytesIO(template_bytes))
+    _worker_state["args"] = (rule_mapping, mitre_index, mitre_table, keep_xlsx)
+
+
+def init_watch_worker(*args):
+    """Инициализирует рабочий процесс режима --watch: Ctrl+C обрабатывает только
+    основной процесс, который сам останавливает пул"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_pipeline_worker(*args)
+
+
+def worker_ready():
+    """Пустая задача: заставляет пул запустить и инициализировать рабочий процесс заранее"""
+    return os.getpid()
+
+
+def process_tenant_in_worker(input_path):
+    """Формирует отчет в рабочем процессе; возвращает результат, время, вывод и замеры этапов"""
+    buffer = io.StringIO()
+    started = time.perf_counter()
+    with redirect_stdout(buffer), file_scope(input_path):
+        success = process_tenant(input_path, _worker_state["template"], *_worker_state["args"])
+    return success, time.perf_counter() - started, buffer.getvalue(), take_spans()
+
+
+def run_pipeline(jobs=1, source="xlsx", mitre_table="rules", keep_xlsx=False):
+    """Формирует отчеты по всем выгрузкам из INPUT"""
+    reordering.ensure_directories_exist()
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+
+    if not os.path.exists(TEMPLATE_FILE):
+        print(f"Файл шаблона '{TEMPLATE_FILE}' не найден")
+        return
+
+    input_paths = [os.path.join(reordering.INPUT_DIR, f) for f in os.listdir(reordering.INPUT_DIR)
+                   if f.endswith('.xlsx')]
+    if not input_paths:
+        print(f"В каталоге '{reordering.INPUT_DIR}' не найдено Excel файлов")
+        return
+
+    try:
+        with span("mapping_source"):
+            rule_mapping, mitre_index = take_rules.load_rules_source(source)
+        with open(TEMPLATE_FILE, "rb") as f:
+            template_bytes = f.read()
+    except Exception as e:
+        print(f"Ошибка при загрузке привязок или шаблона: {e}")
+        return
+
+    started = time.perf_counter()
+    success_count = 0
+
+    if jobs > 1 and len(input_paths) > 1:
+        make_rep.load_font_registry()
+        success_count = run_in_pool(
+            process_tenant_in_worker, {path: (path,) for path in input_paths}, jobs, init_pipeline_worker,
+            (template_bytes, rule_mapping, mitre_index, mitre_table, keep_xlsx, profiling_settings())
+        )
+    else:
+        with span("compile_template"):
+            template = make_rep.CompiledTemplate(io.BytesIO(template_bytes))
+        for input_path in input_paths:
+            print(f"Обработка файла: {input_path}")
+            file_started = time.perf_counter()
+            with file_scope(input_path):
+                success_count += bool(process_tenant(input_path, template, rule_mapping, mitre_index,
+                                                     mitre_table, keep_xlsx))
+            print(f"Время обработки: {time.perf_counter() - file_started:.2f} с")
+
+    print(f"Сформировано отчетов: {success_count} из {len(input_paths)} за {time.perf_counter() - started:.2f} с")
+
+
+def input_stamps():
+    """Возвращает размер и время изменения выгрузок в INPUT (блокировочные файлы Excel ~$ пропускаются)"""
+    stamps = {}
+    for name in os.listdir(reordering.INPUT_DIR):
+        if not name.endswith('.xlsx') or name.startswith('~$'):
+            continue
+        path = os.path.join(reordering.INPUT_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # Файл удален между listdir и stat
+        stamps[path] = (stat.st_size, stat.st_mtime_ns)
+    return stamps
+
+
+def file_stamps(paths):
+    """Возвращает размер и время изменения файлов (None для отсутствующих)"""
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+def report_is_current(input_path):
+    """Проверяет, что отчет по выгрузке сформирован после ее последнего изменения"""
+    try:
+        return os.stat(report_path(input_path)).st_mtime_ns >= os.stat(input_path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def start_workers(jobs, source, mitre_table, keep_xlsx):
+    """Загружает привязки, шаблон и шрифты и запускает пул заранее инициализированных процессов"""
+    rule_mapping, mitre_index = take_rules.load_rules_source(source)
+    with open(TEMPLATE_FILE, "rb") as f:
+        template_bytes = f.read()
+    make_rep.load_font_registry()
+    executor = ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_watch_worker,
+        initargs=(template_bytes, rule_mapping, mitre_index, mitre_table, keep_xlsx, profiling_settings())
+    )
+    # Процессы запускаются по требованию, поэтому сразу нагружаем каждый пустой задачей
+    wait([executor.submit(worker_ready) for _ in range(jobs)])
+    return executor
+
+
+def watch_inputs(jobs=1, source="xlsx", mitre_table="rules", keep_xlsx=False, interval=2.0, settle=5.0,
+                 collect_spans=False):
+    """Следит за каталогом INPUT и формирует отчет по каждой новой или измененной выгрузке.
+
+    Выгрузка берется в работу, когда ее размер и время изменения не менялись
+    settle секунд и файл читается как zip-архив (недописанный xlsx им не является).
+    Рабочие процессы держат разобранный шаблон, привязки и шрифты; при изменении
+    шаблона или файлов привязок, а также после аварийного завершения рабочего
+    процесса пул перезапускается. Замеры этапов накапливаются только при
+    collect_spans (иначе служба копила бы их все время работы).
+    """
+    reordering.ensure_directories_exist()
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+
+    config_paths = [TEMPLATE_FILE] + ([TACTICS_CSV, TECHNIQUES_CSV] if source == "csv" else [take_rules.MITRE_FILE])
+    config_stamp = file_stamps(config_paths)
+    try:
+        executor = start_workers(jobs, source, mitre_table, keep_xlsx)
+    except Exception as e:
+        print(f"Ошибка при загрузке привязок или шаблона: {e}")
+        return
+
+    # Путь -> отпечаток выгрузки, по которому отчет уже сформирован (или попытка завершилась)
+    done = {path: stamp for path, stamp in input_stamps().items() if report_is_current(path)}
+    # Путь -> (отпечаток, время, с которого он не меняется)
+    pending = {}
+    # Задача -> (путь, отпечаток, обрабатывается ли выгрузка отдельно от других)
+    running = {}
+    # Выгрузки, обрабатывавшиеся при аварийном завершении пула: какая из них его
+    # вызвала, неизвестно, поэтому каждая повторяется отдельно от других
+    suspects = set()
+    # (путь, отпечаток) -> число аварийных завершений при отдельной обработке
+    crashes = {}
+
+    def finish_task(future, path, stamp, isolated):
+        """Выводит результат задачи; возвращает True, если пул процессов сломан"""
+        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] Обработка файла: {path}")
+        try:
+            success, elapsed, log, spans = future.result()
+        except BrokenProcessPool:
+            if not isolated:
+                suspects.add(path)
+                print(f"Рабочий процесс аварийно завершился, файл будет обработан повторно отдельно: {path}")
+                return True
+            count = crashes[path, stamp] = crashes.get((path, stamp), 0) + 1
+            if count < MAX_WORKER_CRASHES:
+                print(f"Рабочий процесс аварийно завершился при обработке файла, повторная попытка: {path}")
+            else:
+                print(f"Рабочий процесс аварийно завершался {count} раза при обработке файла, пропуск: {path}")
+                suspects.discard(path)
+                done[path] = stamp
+            return True
+        except CancelledError:
+            # Задача снята при остановке сломанного пула - файл будет взят в работу заново
+            return False
+        except Exception as e:
+            print(f"Ошибка при обработке файла {path}: {e}")
+            suspects.discard(path)
+            done[path] = stamp
+            return False
+        suspects.discard(path)
+        done[path] = stamp
+        print_output(log, elapsed, spans, collect_spans)
+        return False
+
+    print(f"Ожидание выгрузок в каталоге {reordering.INPUT_DIR} (Ctrl+C - остановка), "
+          f"уже обработано: {len(done)}")
+    try:
+        while True:
+            new_config = file_stamps(config_paths)
+            if executor is None or (new_config != config_stamp and not running):
+                if new_config != config_stamp:
+                    print("Шаблон или привязки изменились, рабочие процессы перезапускаются")
+                else:
+                    print("Рабочие процессы перезапускаются")
+                if executor is not None:
+                    executor.shutdown()
+                try:
+                    executor = start_workers(jobs, source, mitre_table, keep_xlsx)
+                except Exception as e:
+                    # Файл мог быть записан не полностью - повторим на следующем проходе
+                    print(f"Ошибка при загрузке привязок или шаблона: {e}")
+                    executor = None
+                    time.sleep(interval)
+                    continue
+                config_stamp = new_config
+
+            now = time.monotonic()
+            stamps = input_stamps()
+            in_work = {path for path, _, _ in running.values()}
+            # Пока выгрузка обрабатывается отдельно, другие в работу не берутся
+            isolating = any(isolated for _, _, isolated in running.values())
+            for path in list(pending):
+                if path not in stamps:
+                    del pending[path]
+            for path, stamp in stamps.items():
+                if done.get(path) == stamp or path in in_work:
+                    continue
+                seen = pending.get(path)
+                if seen is None or seen[0] != stamp:
+                    pending[path] = (stamp, now)
+                    continue
+                if now - seen[1] < settle or executor is None or isolating:
+                    continue
+                if path in suspects and running:
+                    continue
+                if not zipfile.is_zipfile(path):
+                    del pending[path]
+                    print(f"Файл {path} не является книгой xlsx, пропуск")
+                    done[path] = stamp
+                    continue
+                try:
+                    future = executor.submit(process_tenant_in_worker, path)
+                except BrokenProcessPool:
+                    # Процесс умер между задачами; выгрузка останется в ожидании до перезапуска пула
+                    print("Пул рабочих процессов сломан")
+                    executor.shutdown(cancel_futures=True)
+                    executor = None
+                    break
+                del pending[path]
+                isolating = path in suspects
+                running[future] = (path, stamp, isolating)
+
+            if not running:
+                time.sleep(interval)
+                continue
+            finished, _ = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in finished:
+                broken |= finish_task(future, *running.pop(future))
+            if broken:
+                print("Пул рабочих процессов сломан")
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+                    executor = None
+                # Остальные задачи завершаются вместе с пулом; перезапуск - на следующем проходе
+                for future in list(running):
+                    finish_task(future, *running.pop(future))
+    except KeyboardInterrupt:
+        print("Наблюдение остановлено")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозное формирование отчетов DOCX по выгрузкам KUMA из каталога INPUT")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="число параллельных процессов (0 - по числу ядер)")
+    parser.add_argument("--source", choices=["xlsx", "csv"], default="xlsx",
+                        help="источник привязок: MITRE.xlsx или CSV-файлы D001/D002")
+    parser.add_argument("--mitre-table", choices=["rules", "tactics"], default="rules",
+                        help="таблица MITRE: строка на каждое правило или сводка по тактикам с числом правил")
+    parser.add_argument("--keep-xlsx", action="store_true",
+                        help=f"сохранять обработанные книги в {reordering.OUTPUT_DIR} для отладки")
+    parser.add_argument("--watch", action="store_true",
+                        help=f"работать как служба: следить за {reordering.INPUT_DIR} и формировать отчеты по новым выгрузкам")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="период опроса каталога в режиме --watch, с")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="сколько секунд файл не должен меняться, чтобы считаться записанным")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    configure_profiling(args.profile, args.profile_dir)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    if args.watch:
+        watch_inputs(jobs, args.source, args.mitre_table, args.keep_xlsx, args.interval, args.settle,
+                     collect_spans=bool(args.timings))
+    else:
+        run_pipeline(jobs, args.source, args.mitre_table, args.keep_xlsx)
+    if args.timings:
+        write_report(args.timings, "pipeline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Замеры времени этапов и профилирование скриптов формирования отчетов"""
+import cProfile
+import csv
+import importlib.util
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILERS = ("cprofile", "pyinstrument")
+REPORT_FIELDS = ("script", "file", "stage", "started", "seconds")
+
+# Завершенные отрезки текущего процесса
+_spans = []
+# Файл, к которому относятся отрезки, и настройки профилирования
+_current_file = None
+_profiler = None
+_profile_dir = "profiles"
+
+
+def configure_profiling(profiler=None, profile_dir="profiles"):
+    """Включает профилирование обработки каждого файла: None, "cprofile" или "pyinstrument".
+
+    В рабочих процессах применяется через init_worker, чтобы настройка
+    не зависела от способа их запуска.
+    """
+    global _profiler, _profile_dir
+    if profiler == "pyinstrument" and importlib.util.find_spec("pyinstrument") is None:
+        print("Пакет pyinstrument не установлен, используется cProfile")
+        profiler = "cprofile"
+    _profiler = profiler
+    _profile_dir = profile_dir
+
+
+def init_worker(profiler=None, profile_dir="profiles"):
+    """Инициализирует замеры в рабочем процессе пула: отрезки, унаследованные
+    от родителя при fork, отбрасываются, настройки профилирования применяются заново"""
+    _spans.clear()
+    configure_profiling(profiler, profile_dir)
+
+
+def profiling_settings():
+    """Возвращает аргументы configure_profiling (и init_worker) текущего процесса"""
+    return _profiler, _profile_dir
+
+
+def add_arguments(parser):
+    """Добавляет в argparse ключи отчета о времени и профилирования"""
+    parser.add_argument("--timings", metavar="ФАЙЛ",
+                        help="сохранить время этапов в JSON или CSV (по расширению файла)")
+    parser.add_argument("--profile", choices=PROFILERS,
+                        help="профилировать обработку каждого файла")
+    parser.add_argument("--profile-dir", default="profiles",
+                        help="каталог для профилей (по умолчанию profiles)")
+
+
+@contextmanager
+def span(stage):
+    """Замеряет время этапа обработки текущего файла"""
+    started = time.time()
+    clock = time.perf_counter()
+    try:
+        yield
+    finally:
+        _spans.append({
+            "file": _current_file,
+            "stage": stage,
+            "started": round(started, 6),
+            "seconds": round(time.perf_counter() - clock, 6),
+        })
+
+
+def _start_profiler():
+    if _profiler == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+    if _profiler == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    return None
+
+
+def _stop_profiler(profiler, file):
+    if profiler is None:
+        return
+    os.makedirs(_profile_dir, exist_ok=True)
+    base_path = os.path.join(_profile_dir, os.path.basename(file))
+    if _profiler == "pyinstrument":
+        profiler.stop()
+        with open(base_path + ".html", "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(base_path + ".prof")
+
+
+@contextmanager
+def file_scope(file):
+    """Относит вложенные отрезки к файлу, замеряет его общее время (этап total)
+    и при включенном профилировании сохраняет профиль обработки файла"""
+    global _current_file
+    previous = _current_file
+    _current_file = os.path.basename(file)
+    profiler = _start_profiler()
+    try:
+        with span("total"):
+            yield
+    finally:
+        _stop_profiler(profiler, file)
+        _current_file = previous
+
+
+def take_spans():
+    """Возвращает и очищает отрезки процесса (для передачи из рабочего процесса)"""
+    spans = list(_spans)
+    _spans.clear()
+    return spans
+
+
+def add_spans(spans):
+    """Добавляет отрезки, полученные из рабочего процесса"""
+    _spans.extend(spans)
+
+
+def summarize(spans=None):
+    """Возвращает суммарное время и число замеров по этапам"""
+    summary = {}
+    for item in _spans if spans is None else spans:
+        stage = summary.setdefault(item["stage"], {"count": 0, "seconds": 0.0})
+        stage["count"] += 1
+        stage["seconds"] = round(stage["seconds"] + item["seconds"], 6)
+    return summary
+
+
+def write_report(path, script):
+    """Сохраняет отрезки запуска в JSON или CSV (по расширению файла)"""
+    spans = [dict(item, script=script) for item in _spans]
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(spans)
+    else:
+        report = {
+            "script": script,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "summary": summarize(),
+            "spans": spans,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"Отчет о времени этапов сохранен: {path}")
@@ -0,0 +1,151 @@
+"""Кэш результатов: файл не формируется заново, если его входные данные не изменились.
+
+Результат хранится под ключом - хэшем содержимого входной книги и всего,
+от чего он зависит (шаблон, привязки, параметры запуска, версия кода).
+При совпадении ключа готовый файл копируется из кэша вместо обработки.
+"""
+import filecmp
+import hashlib
+import os
+import shutil
+import time
+
+CACHE_DIR = "cache"
+DEFAULT_MAX_AGE_DAYS = 90
+DEFAULT_MAX_SIZE_MB = 1024
+
+
+def file_digest(path):
+    """Возвращает SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def optional_digest(path):
+    """Возвращает SHA-256 файла или пометку его отсутствия"""
+    try:
+        return file_digest(path)
+    except OSError:
+        return "missing:" + os.path.basename(path)
+
+
+def code_version(*paths):
+    """Возвращает отпечаток исходного кода: при любой правке скриптов кэш устаревает"""
+    return "+".join(file_digest(path)[:16] for path in paths)
+
+
+class ResultCache:
+    """Кэш результатов одного скрипта (namespace) в рамках одного запуска.
+
+    context - части ключа, общие для всех файлов запуска (версия кода, хэши
+    шаблона и привязок, параметры); объект передается в рабочие процессы.
+    """
+
+    def __init__(self, namespace, context=(), cache_dir=CACHE_DIR, force=False):
+        self.directory = os.path.join(cache_dir, namespace)
+        self.context = tuple(str(part) for part in context)
+        self.force = force
+
+    def key(self, input_path):
+        """Возвращает ключ результата для входного файла"""
+        digest = hashlib.sha256()
+        for part in self.context + (file_digest(input_path),):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def entry_path(self, key, output_path):
+        return os.path.join(self.directory, key[:2], key + os.path.splitext(output_path)[1])
+
+    def fetch(self, key, output_path):
+        """Восстанавливает результат из кэша; возвращает False, если его нет (или задан --force).
+
+        Совпадающий с кэшем файл не перезаписывается.
+        """
+        if self.force:
+            return False
+        entry = self.entry_path(key, output_path)
+        try:
+            # Время изменения записи - время последнего использования (для очистки по возрасту)
+            os.utime(entry)
+        except OSError:
+            return False
+        if not (os.path.exists(output_path) and filecmp.cmp(entry, output_path, shallow=False)):
+            shutil.copyfile(entry, output_path)
+        return True
+
+    def store(self, key, output_path):
+        """Сохраняет результат в кэш; ошибки записи кэша обработку не прерывают"""
+        entry = self.entry_path(key, output_path)
+        temp_path = f"{entry}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            shutil.copyfile(output_path, temp_path)
+            os.replace(temp_path, entry)
+        except OSError as e:
+            print(f"Не удалось сохранить результат в кэш: {e}")
+
+
+def evict_cache(cache_dir=CACHE_DIR, max_age_days=DEFAULT_MAX_AGE_DAYS, max_size_mb=DEFAULT_MAX_SIZE_MB):
+    """Удаляет записи, не использованные дольше max_age_days, затем самые старые,
+    пока общий размер кэша больше max_size_mb; возвращает число удаленных записей"""
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    entries.sort()
+    expire_before = time.time() - max_age_days * 86400
+    total_size = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if mtime >= expire_before and total_size <= max_size_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+        removed += 1
+        try:
+            os.rmdir(os.path.dirname(path))  # Удаляется только опустевший каталог
+        except OSError:
+            pass
+    if removed:
+        print(f"Удалено устаревших записей кэша: {removed}")
+    return removed
+
+
+def add_cache_arguments(parser):
+    """Добавляет в argparse ключи кэша результатов"""
+    parser.add_argument("--force", action="store_true",
+                        help="формировать все файлы заново, не используя кэш результатов")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="не использовать и не пополнять кэш результатов")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help=f"каталог кэша результатов (по умолчанию {CACHE_DIR})")
+    parser.add_argument("--cache-max-age", type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help="удалять из кэша записи, не использованные указанное число дней")
+    parser.add_argument("--cache-max-size", type=float, default=DEFAULT_MAX_SIZE_MB,
+                        help="максимальный размер кэша, МБ")
+
+
+def open_cache(args, namespace, *context):
+    """Создает кэш по ключам командной строки (None при --no-cache)"""
+    if args.no_cache:
+        return None
+    return ResultCache(namespace, context, args.cache_dir, args.force)
+
+
+def close_cache(args):
+    """Очищает кэш по возрасту и размеру в конце запуска"""
+    if not args.no_cache:
+        evict_cache(args.cache_dir, args.cache_max_age, args.cache_max_size)
@@ -0,0 +1,112 @@
+"""Сопоставление правил корреляции с тактиками и техниками MITRE ATT&CK по CSV-файлам D001/D002"""
+import re
+import sys
+
+TACTICS_CSV = "D001_Tactic. Rules mapping.csv"
+TECHNIQUES_CSV = "D002_Technique. Rules mapping.csv"
+
+# Названия тактик совпадают с заголовками столбцов MITRE.xlsx
+TACTIC_NAMES = {
+    "TA0040": "Деструктивное воздействие",
+    "TA0042": "Подготовка ресурсов",
+    "TA0043": "Разведка",
+    "TA0001": "Первоначальный доступ",
+    "TA0002": "Выполнение",
+    "TA0003": "Закрепление",
+    "TA0004": "Повышение привилегий",
+    "TA0005": "Предотвращение обнаружения",
+    "TA0006": "Получение учетных данных",
+    "TA0007": "Обнаружение",
+    "TA0008": "Перемещение",
+    "TA0009": "Сбор данных",
+    "TA0011": "Организация управления",
+    "TA0010": "Эксфильтрация данных",
+}
+
+RULE_CODE_PATTERN = re.compile(r'R\d+(_\d+)*')
+
+
+def extract_rule_code(rule_name):
+    """Извлекает код правила (R001_01) из его названия"""
+    match = RULE_CODE_PATTERN.search(str(rule_name))
+    return match.group(0) if match else None
+
+
+def read_rule_csv(path):
+    """Читает построчно CSV вида 'правило,ид1, ид2, ...' в индекс правило -> кортеж идентификаторов.
+
+    Кавычки не разбираются, а отбрасываются: в файле тактик строки целиком взяты
+    в кавычки с удвоенными внутренними кавычками, что ломает обычный csv-парсер.
+    """
+    index = {}
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            rule, _, rest = line.replace('"', '').strip().partition(',')
+            rule = rule.strip()
+            if not rule:
+                continue
+            ids = index.get(rule, ())
+            for item in rest.split(','):
+                item = sys.intern(item.strip())
+                if item and item not in ids:
+                    ids += (item,)
+            index[rule] = ids
+    return index
+
+
+class RuleMapping:
+    """Индексы правило -> тактики и правило -> техники.
+
+    Метод get() совместим со словарем название правила -> тактика, который
+    используют make_rep.py и take_rules.py, и возвращает первую тактику правила.
+    """
+
+    def __init__(self, tactics, techniques):
+        self.tactics = tactics
+        self.techniques = techniques
+        # Для названий без варианта (R035) - объединение всех вариантов R035_NN
+        self._tactics_by_root = self._merge_variants(tactics)
+        self._techniques_by_root = self._merge_variants(techniques)
+
+    @staticmethod
+    def _merge_variants(index):
+        merged = {}
+        for rule, ids in index.items():
+            root = rule.split('_', 1)[0]
+            current = merged.get(root, ())
+            merged[root] = current + tuple(i for i in ids if i not in current)
+        return merged
+
+    @staticmethod
+    def _lookup(index, by_root, rule_name):
+        code = extract_rule_code(rule_name)
+        if not code:
+            return ()
+        # R001_01_2 -> R001_01 -> R001
+        while True:
+            if code in index:
+                return index[code]
+            if '_' not in code:
+                return by_root.get(code, ())
+            code = code.rsplit('_', 1)[0]
+
+    def rule_tactics(self, rule_name):
+        """Возвращает идентификаторы тактик правила"""
+        return self._lookup(self.tactics, self._tactics_by_root, rule_name)
+
+    def rule_techniques(self, rule_name):
+        """Возвращает идентификаторы техник правила"""
+        return self._lookup(self.techniques, self._techniques_by_root, rule_name)
+
+    def tactic_names(self, rule_name):
+        """Возвращает названия тактик правила"""
+        return [TACTIC_NAMES.get(t, t) for t in self.rule_tactics(rule_name)]
+
+    def get(self, rule_name, default=None):
+        names = self.tactic_names(rule_name)
+        return names[0] if names else default
+
+
+def load_rule_mapping(tactics_path=TACTICS_CSV, techniques_path=TECHNIQUES_CSV):
+    """Загружает сопоставление правил из CSV-файлов тактик и техник"""
+    return RuleMapping(read_rule_csv(tactics_path), read_rule_csv(techniques_path))
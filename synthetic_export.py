@@ -0,0 +1,163 @@
+"""Синтетические выгрузки KUMA для замеров производительности без данных заказчиков.
+
+Книга повторяет структуру настоящей выгрузки: листы TARGET_ORDER (и лишний лист,
+который пересортировка отбрасывает), в первой строке - название листа, период
+и организация, во второй - заголовки столбцов COLUMN_ORDER в другом порядке,
+с 3 строки - данные. Любой лист может быть выгружен как "No Data".
+Книга пишется в режиме write_only, поэтому и миллион строк не требует много памяти.
+
+Запуск: python synthetic_export.py --rows 100000 --count 3 --out INPUT
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.styles.cell_style import StyleArray
+
+from rule_mapping import TECHNIQUES_CSV, read_rule_csv
+
+PERIOD = "2025-05-01T00:00:00+03:00 - 2025-05-31T00:00:00+03:00"
+COMPANY = "ООО Ромашка"
+MIN_ROWS = 10
+MAX_ROWS = 1_000_000
+
+# Столбцы листов в порядке выгрузки KUMA (пересортировка приводит их к COLUMN_ORDER)
+EXPORT_COLUMNS = {
+    "Общее число собы�": ["value", "metric"],
+    "Общее количество": ["value", "metric"],
+    "Последние инциде": ["id", "name", "tenantID", "createdAt", "priority", "status", "severity", "tenantName", "extra"],
+    "Активы в инциден�": ["name", "tenantID", "tenantName", "weight", "count", "id"],
+    "Затронутые актив": ["displayName", "frequency", "tenantID", "tenantName", "id", "criticality"],
+    "Распределение ал": ["metric", "value"],
+    "Последние 10 алер�": ["id", "tenantID", "correlationRuleName", "tenantName", "severity", "name", "status",
+                           "firstSeen", "userName", "priority"],
+}
+SHEET_NAMES = list(EXPORT_COLUMNS)
+
+# Доля пустых ячеек и ячеек с оформлением среди данных
+EMPTY_SHARE = 0.05
+STYLED_SHARE = 0.7
+
+
+def rule_codes():
+    """Возвращает коды правил из файла техник D002 (или условные коды, если его нет)"""
+    try:
+        return sorted(read_rule_csv(TECHNIQUES_CSV))
+    except OSError:
+        return [f"R{i:03d}" for i in range(1, 301)]
+
+
+def alert_name(rnd, codes, row):
+    """Значение столбца value листа "Распределение ал": правила R... вперемешку с прочими алертами"""
+    roll = rnd.random()
+    if roll < 0.6:
+        return f"{rnd.choice(codes)}_Правило {rnd.randint(1, 3)}"
+    if roll < 0.9:
+        return f"Прочее {row}"
+    return None
+
+
+def cell_value(rnd, sheet_name, header, row, rows, codes):
+    """Возвращает правдоподобное значение ячейки данных"""
+    if rnd.random() < EMPTY_SHARE:
+        return None
+    if header == "metric":
+        return rnd.randint(0, 10000)
+    if header == "value" and sheet_name == "Распределение ал":
+        return alert_name(rnd, codes, row)
+    if header in ("createdAt", "firstSeen"):
+        return datetime(2025, 5, 1) + timedelta(minutes=row)
+    if header == "weight":
+        return rnd.random()
+    if header == "displayName":
+        return f"host-{rnd.randint(1, rows)}.corp"
+    return f"{header}-{rnd.randint(1, 50)}"
+
+
+def write_synthetic_export(path, rows=1000, no_data=(), seed=1):
+    """Записывает синтетическую выгрузку KUMA с rows строками данных на каждом листе.
+
+    no_data - листы, выгружаемые как "No Data" (или "all" для всех листов).
+    """
+    if not MIN_ROWS <= rows <= MAX_ROWS:
+        raise ValueError(f"Число строк должно быть от {MIN_ROWS} до {MAX_ROWS}")
+    if no_data == "all":
+        no_data = SHEET_NAMES
+
+    rnd = random.Random(seed)
+    codes = rule_codes()
+    bold = Font(bold=True, name="Arial", size=11)
+    fill = PatternFill("solid", fgColor="FFDDEEFF")
+    side = Side(style="thin")
+    border = Border(left=side, right=side, top=side, bottom=side)
+    alignment = Alignment(horizontal="center", wrap_text=True)
+
+    wb = Workbook(write_only=True)
+    extra = wb.create_sheet("Лишний лист")
+    extra.append(["x"])
+
+    for sheet_name, headers in EXPORT_COLUMNS.items():
+        ws = wb.create_sheet(sheet_name)
+        # Стиль ячеек данных вычисляется один раз: присваивание border и alignment
+        # каждой ячейке заняло бы большую часть времени генерации
+        data_style = WriteOnlyCell(ws)
+        data_style.border = border
+        data_style.alignment = alignment
+        title = WriteOnlyCell(ws, value=sheet_name)
+        title.font = bold
+        ws.append([title, PERIOD, COMPANY])
+        if sheet_name in no_data:
+            ws.append(["No Data"])
+            continue
+
+        header_row = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = bold
+            cell.fill = fill
+            cell.border = border
+            header_row.append(cell)
+        ws.append(header_row)
+
+        for row in range(3, rows + 3):
+            values = []
+            for header in headers:
+                value = cell_value(rnd, sheet_name, header, row, rows, codes)
+                if rnd.random() < STYLED_SHARE:
+                    # Значение присваивается после стиля: даты получают свой формат числа
+                    cell = WriteOnlyCell(ws)
+                    cell._style = StyleArray(data_style._style)
+                    cell.value = value
+                    value = cell
+                values.append(value)
+            ws.append(values)
+
+    wb.save(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетических выгрузок KUMA")
+    parser.add_argument("--rows", type=int, default=1000,
+                        help=f"число строк данных на каждом листе ({MIN_ROWS}-{MAX_ROWS})")
+    parser.add_argument("--count", type=int, default=1, help="число выгрузок")
+    parser.add_argument("--no-data", nargs="*", default=(), metavar="ЛИСТ",
+                        help="листы, выгружаемые как 'No Data' (all - все листы)")
+    parser.add_argument("--seed", type=int, default=1, help="начальное значение генератора случайных чисел")
+    parser.add_argument("--out", default="INPUT", help="каталог для выгрузок (по умолчанию INPUT)")
+    args = parser.parse_args()
+
+    no_data = "all" if "all" in args.no_data else args.no_data
+    os.makedirs(args.out, exist_ok=True)
+    for i in range(args.count):
+        path = os.path.join(args.out, f"synthetic_{args.rows}_{i + 1}.xlsx")
+        write_synthetic_export(path, args.rows, no_data, args.seed + i)
+        print(f"Создана выгрузка: {path}")
+
+
+if __name__ == "__main__":
+    main()
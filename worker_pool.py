@@ -0,0 +1,67 @@
+"""Параллельная обработка файлов в пуле процессов, общая для всех скриптов"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from pipeline_timing import add_spans
+
+
+def print_output(log, elapsed=None, spans=(), collect_spans=True):
+    """Печатает собранный в рабочем процессе вывод файла и время его обработки,
+    добавляя замеры этапов к замерам текущего процесса"""
+    print(log, end="")
+    if collect_spans:
+        add_spans(spans)
+    if elapsed is not None:
+        print(f"Время обработки: {elapsed:.2f} с")
+
+
+def run_tasks(worker, tasks, jobs, initializer, initargs, header):
+    """Выполняет задачи в одном пуле; возвращает число успешных и имена файлов,
+    обработка которых прервана аварийным завершением рабочего процесса"""
+    success_count = 0
+    broken = []
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)), initializer=initializer,
+                             initargs=initargs) as executor:
+        futures = {}
+        for name, args in tasks.items():
+            try:
+                futures[executor.submit(worker, *args)] = name
+            except BrokenProcessPool:
+                broken.append(name)
+        for future in as_completed(futures):
+            name = futures[future]
+            print(header.format(name))
+            try:
+                success, elapsed, log, spans = future.result()
+            except BrokenProcessPool:
+                print(f"Рабочий процесс аварийно завершился при обработке файла {name}")
+                broken.append(name)
+                continue
+            except Exception as e:
+                print(f"Ошибка при обработке файла {name}: {e}")
+                continue
+            print_output(log, elapsed, spans)
+            success_count += bool(success)
+    return success_count, broken
+
+
+def run_in_pool(worker, tasks, jobs, initializer=None, initargs=(), header="Обработка файла: {}"):
+    """Выполняет worker(*args) для каждой задачи в пуле из jobs процессов; возвращает число успешных.
+
+    tasks - словарь: имя файла для журнала -> аргументы worker. worker возвращает
+    (успех, время или None, вывод, замеры этапов); вывод каждого файла печатается одним блоком
+    по завершении (после header с именем файла), чтобы журналы разных файлов не смешивались.
+
+    Аварийное завершение рабочего процесса (например, из-за нехватки памяти) ломает весь пул,
+    и какой файл его вызвал, неизвестно. Поэтому прерванные файлы повторяются по одному,
+    каждый в новом пуле, а файл, снова приведший к аварийному завершению, пропускается.
+    """
+    success_count, broken = run_tasks(worker, tasks, jobs, initializer, initargs, header)
+    if broken:
+        print(f"Пул рабочих процессов сломан, файлы будут обработаны повторно по одному: {len(broken)}")
+    for name in broken:
+        retried, failed = run_tasks(worker, {name: tasks[name]}, 1, initializer, initargs, header)
+        success_count += retried
+        if failed:
+            print(f"Рабочий процесс снова аварийно завершился, файл пропущен: {name}")
+    return success_count